@@ -0,0 +1,71 @@
+"""
+Frame scrubbing benchmark for ThorImageArraySource.get_frame.
+
+Writes a synthetic 512x512 uint16 raw stack (or uses an existing session
+folder) and reports frames per second for forward playback, reverse playback
+and random access, compared against ``to_dask()[i].compute()``.
+
+Usage::
+
+    python benchmarks/bench_frames.py [--path SESSION_DIR] [-n FRAMES]
+
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from intake_thorlabs import ThorImageArraySource  # noqa: E402
+
+
+def fps(func, indices) -> float:
+    t0 = time.perf_counter()
+    for i in indices:
+        func(i)
+    return len(indices) / (time.perf_counter() - t0)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--path", help="existing session folder")
+    parser.add_argument("-n", "--frames", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shape = None
+        if args.path:
+            path = args.path
+        else:
+            path = Path(tmp) / "Image_0001_0001.raw"
+            shape = (args.frames, 512, 512)
+            frames = np.random.default_rng(0).integers(0, 4096, shape)
+            frames.astype("<H").tofile(path)
+
+        n = args.frames
+        rng = np.random.default_rng(1)
+        patterns = {
+            "forward": np.arange(n),
+            "reverse": np.arange(n)[::-1],
+            "random": rng.integers(0, n, n),
+        }
+        for name, indices in patterns.items():
+            src = ThorImageArraySource(path, shape=shape)
+            rate = fps(src.get_frame, indices)
+            src.close()
+            print(f"get_frame  {name:<8} {rate:10.1f} fps")
+
+        src = ThorImageArraySource(path, shape=shape)
+        arr = src.to_dask()
+        rate = fps(lambda i: arr[i].compute(), patterns["forward"][:200])
+        print(f"dask       {'forward':<8} {rate:10.1f} fps")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Cold-import benchmark for intake_thorlabs.
+
+Each measurement runs in a fresh interpreter and reads the cumulative time
+reported by ``python -X importtime``, so results aren't polluted by modules
+already loaded in this process.
+
+Usage::
+
+    python benchmarks/bench_import.py [-n REPEATS] [--budget MS] [MODULE ...]
+
+Exits with a non-zero status if the median of the first module exceeds
+``--budget``.
+
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import List
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Modules that must not be loaded as a side effect of importing the package.
+HEAVY_MODULES = ("intake", "numpy", "pandas", "h5py", "dask")
+
+
+def import_time(module: str, preload: str = "") -> float:
+    """
+    Return the cumulative import time of `module` in ms, measured in a fresh
+    interpreter. Modules in `preload` are imported first and not counted.
+    """
+    stmt = f"{preload}; import {module}" if preload else f"import {module}"
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", stmt],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    for line in reversed(proc.stderr.splitlines()):
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def loaded_heavy_modules(module: str) -> List[str]:
+    """Return the heavy dependencies loaded by importing `module`."""
+    code = (
+        f"import sys, {module}; "
+        f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    proc = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    return proc.stdout.split()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("modules", nargs="*", default=["intake_thorlabs"])
+    parser.add_argument("-n", "--repeats", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=10.0,
+                        help="budget in ms for the first module's median")
+    args = parser.parse_args(argv)
+
+    status = 0
+    for i, module in enumerate(args.modules):
+        # drivers are loaded by intake, so intake itself isn't counted.
+        preload = "" if module == "intake_thorlabs" else "import intake"
+        times = [import_time(module, preload) for _ in range(args.repeats)]
+        median = statistics.median(times)
+        print(f"{module:<28} median {median:7.2f} ms   "
+              f"min {min(times):7.2f} ms   max {max(times):7.2f} ms")
+        if i == 0:
+            heavy = loaded_heavy_modules(module)
+            if heavy:
+                print(f"  loads heavy modules: {', '.join(heavy)}")
+                status = 1
+            if median > args.budget:
+                print(f"  over budget ({args.budget:.1f} ms)")
+                status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
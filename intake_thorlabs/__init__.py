@@ -1,5 +1,62 @@
+"""
+Intake plugin for ThorImage and ThorSync data.
+
+The drivers are imported on first access so that importing the package (which
+intake does for every catalog operation) doesn't pull in intake, numpy,
+pandas, h5py or dask.
+
+"""
+import importlib
+
 from . import _version
-from .thorimage import *
-from .thorsync import *
 
 __version__ = _version.get_version()
+
+# public name -> submodule defining it
+_lazy_exports = {
+    "ThorExperimentSource": "experiment",
+    "ThorImageArraySource": "thorimage",
+    "ThorImageMetadataSource": "thorimage",
+    "ThorSyncSource": "thorsync",
+}
+
+# submodules reachable as attributes without an explicit import
+_lazy_submodules = {
+    "aio",
+    "blocks",
+    "columnar",
+    "common",
+    "concat",
+    "corrections",
+    "experiment",
+    "frames",
+    "h5pool",
+    "instrument",
+    "integrity",
+    "registration",
+    "runs",
+    "thorimage",
+    "thorsync",
+    "tiff",
+}
+
+__all__ = list(_lazy_exports)
+
+
+def __getattr__(name: str):
+    if name in _lazy_submodules:
+        return importlib.import_module(f".{name}", __name__)
+    try:
+        modname = _lazy_exports[name]
+    except KeyError:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        ) from None
+    module = importlib.import_module(f".{modname}", __name__)
+    obj = getattr(module, name)
+    globals()[name] = obj
+    return obj
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
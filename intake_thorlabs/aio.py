@@ -0,0 +1,217 @@
+"""
+asyncio support.
+
+File discovery, XML parsing and h5 opens are blocking, so the async methods
+(`to_dict_async`, `get_schema_async`) run them on shared, bounded thread
+pools: an "io" pool for directory scans, stats and XML, and a smaller "h5"
+pool, since HDF5 calls are serialized by h5py's global lock and more threads
+would only queue behind it. Each pool also caps the number of jobs waiting
+for it per event loop, so a request for hundreds of sessions holds coroutines
+back instead of flooding the queue.
+
+`gather_sessions` loads metadata, sync schemas and file stats for many
+sessions concurrently::
+
+    sessions = await gather_sessions(paths)
+
+"""
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+from .common import PathLike
+
+__all__ = [
+    "BoundedExecutor",
+    "configure_executor",
+    "gather_sessions",
+    "get_executor",
+]
+
+T = TypeVar("T")
+
+
+class BoundedExecutor:
+    """
+    Thread pool for blocking calls made from coroutines, with backpressure.
+
+    Parameters
+    ----------
+    max_workers: int
+        Number of threads.
+    max_pending: int, optional
+        Maximum number of jobs queued or running per event loop. Further
+        `run` calls wait (without blocking the loop) until a slot frees up.
+        Defaults to twice `max_workers`.
+    name: str, optional
+        Thread name prefix.
+
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_pending: Optional[int] = None,
+        name: str = "intake_thorlabs-aio",
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending or 2 * max_workers
+        self.name = name
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphores: "weakref.WeakKeyDictionary" = \
+            weakref.WeakKeyDictionary()
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Call `func(*args, **kwargs)` on the pool and await the result."""
+        loop = asyncio.get_running_loop()
+        async with self._semaphore(loop):
+            return await loop.run_in_executor(
+                self._pool(), lambda: func(*args, **kwargs),
+            )
+
+    def configure(self, **kwargs: Any) -> None:
+        """
+        Update `max_workers` or `max_pending`. Takes effect for jobs
+        submitted afterwards; running jobs finish on the old pool.
+        """
+        with self._lock:
+            for name, val in kwargs.items():
+                if name not in {"max_workers", "max_pending"}:
+                    raise TypeError(f"unknown executor setting: {name}")
+                setattr(self, name, val)
+            old, self._executor = self._executor, None
+            self._semaphores = weakref.WeakKeyDictionary()
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            old, self._executor = self._executor, None
+        if old is not None:
+            old.shutdown(wait=wait)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.name,
+                )
+            return self._executor
+
+    def _semaphore(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        # asyncio primitives belong to one loop, so keep one per loop.
+        with self._lock:
+            sem = self._semaphores.get(loop)
+            if sem is None:
+                sem = self._semaphores[loop] = asyncio.Semaphore(
+                    self.max_pending
+                )
+            return sem
+
+
+_executors = {
+    "io": BoundedExecutor(
+        min(32, (os.cpu_count() or 1) + 4), name="intake_thorlabs-io",
+    ),
+    "h5": BoundedExecutor(2, max_pending=8, name="intake_thorlabs-h5"),
+}
+
+
+def get_executor(kind: str = "io") -> BoundedExecutor:
+    """Return the shared "io" or "h5" executor."""
+    try:
+        return _executors[kind]
+    except KeyError:
+        raise ValueError(f"unknown executor: {kind}") from None
+
+
+def configure_executor(kind: str = "io", **kwargs: Any) -> BoundedExecutor:
+    """
+    Configure a shared executor. See `BoundedExecutor` for settings.
+    """
+    executor = get_executor(kind)
+    executor.configure(**kwargs)
+    return executor
+
+
+async def gather_sessions(
+    paths: Iterable[PathLike],
+    *,
+    sync: bool = True,
+    return_exceptions: bool = False,
+    **kwargs: Any,
+) -> List[Any]:
+    """
+    Load metadata, file stats and (optionally) sync schemas for many
+    experiment folders concurrently.
+
+    Parameters
+    ----------
+    paths: iterable of path-like
+        Experiment folders (see `ThorExperimentSource`).
+    sync: bool, optional
+        Also return each session's sync schema (the "sync" member of the
+        experiment schema).
+    return_exceptions: bool, optional
+        Return a session's exception in its slot instead of raising it.
+    kwargs:
+        Passed to `ThorExperimentSource`.
+
+    Returns
+    -------
+    sessions: list of dict
+        In the order of `paths`, each with keys 'path', 'files', 'stats'
+        (path of every member file -> dict of size and mtime), 'metadata' and 'sync' (the
+        sync schema, or `None`).
+
+    """
+    coros = [_load_session(p, sync, kwargs) for p in paths]
+    return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+
+
+async def _load_session(
+    path: PathLike,
+    sync: bool,
+    kwargs: Dict[str, Any],
+) -> Dict[str, Any]:
+    from .experiment import ThorExperimentSource
+
+    exp = ThorExperimentSource(path, **kwargs)
+    try:
+        schema = await exp.get_schema_async()
+        files = schema["files"]
+        io = get_executor("io")
+        stats = await io.run(_stat_files, schema["paths"])
+        return dict(
+            path=exp.path,
+            files=files,
+            stats=stats,
+            metadata=schema["extra_metadata"],
+            sync=schema["sync"] if sync else None,
+        )
+    finally:
+        exp.close()
+
+
+def _stat_files(
+    files: Dict[str, Sequence[str]],
+) -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for paths in files.values():
+        for path in paths:
+            st = os.stat(path)
+            out[path] = dict(size=st.st_size, mtime=st.st_mtime)
+    return out
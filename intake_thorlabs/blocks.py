@@ -0,0 +1,306 @@
+"""
+Lightweight, picklable dask graphs for frame stacks on disk.
+
+`dask.array.from_array(np.memmap(...))` embeds the memmap in every task, so
+process-based and distributed schedulers pickle (and with some versions copy)
+the mapped array, and all reads funnel through one object. Instead, each task
+here carries a `BlockReader` -- a few hundred bytes describing the file,
+offset, shape, dtype and strides of the stack -- plus the slice it covers.
+Workers map each file once and reuse the mapping across tasks, so graphs stay
+small and reads scale across processes and machines.
+
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from . import instrument
+from .common import PathLike
+
+if TYPE_CHECKING:
+    import dask.array as da
+    import numpy as np
+    from numpy.typing import DTypeLike
+
+    from .concat import ConcatArray
+
+__all__ = [
+    "BlockReader",
+    "ConcatReader",
+    "clear_handles",
+    "stack_to_dask",
+]
+
+_MAX_HANDLES = 32
+_handles: "OrderedDict[Tuple[str, str], Tuple[Tuple[int, int], Any]]" = \
+    OrderedDict()
+_handles_lock = threading.Lock()
+_handles_pid = os.getpid()
+
+
+class BlockReader:
+    """
+    Picklable description of a (t, y, x) frame stack stored in a file.
+
+    Parameters
+    ----------
+    path: path-like
+        File holding the stack.
+    shape: tuple of int
+        Shape of the stack.
+    dtype: dtype-like
+        Pixel dtype.
+    offset: int, optional
+        Byte offset of the first frame.
+    strides: tuple of int, optional
+        Byte strides of the stack. Defaults to C order.
+    kind: str, optional
+        "memmap" for stacks that can be mapped directly (raw files and
+        uncompressed TIFFs), "tiff" for stacks decoded with `tiff.TiffStack`.
+
+    """
+
+    __slots__ = ("path", "shape", "dtype", "offset", "strides", "kind")
+
+    def __init__(
+        self,
+        path: PathLike,
+        shape: Tuple[int, ...],
+        dtype: "DTypeLike",
+        offset: int = 0,
+        strides: Optional[Tuple[int, ...]] = None,
+        kind: str = "memmap",
+    ):
+        import numpy as np
+
+        if kind not in ("memmap", "tiff"):
+            raise ValueError(f"invalid kind: {kind}")
+        self.path = os.path.abspath(os.fspath(path))
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.offset = int(offset)
+        self.strides = tuple(strides) if strides is not None else None
+        self.kind = kind
+
+    def __getstate__(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state: tuple) -> None:
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __dask_tokenize__(self) -> tuple:
+        return (type(self).__name__, self.__getstate__())
+
+    def version(self) -> Tuple[int, int]:
+        """Size and mtime of the file, to tell rewritten files apart."""
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime_ns
+
+    def __repr__(self) -> str:
+        return f"BlockReader({self.path!r}, shape={self.shape}, " \
+               f"dtype={str(self.dtype)!r}, kind={self.kind!r})"
+
+    def __call__(self, index: Tuple[slice, ...]) -> "np.ndarray":
+        """
+        Return the block of the stack selected by `index`: a view of this
+        process's mapping of the file, or freshly decoded TIFF pages.
+        """
+        return _get_handle(self)[index]
+
+    def open(self) -> Any:
+        """
+        Return this process's array over the file: a read-only memmap view,
+        or a `tiff.TiffStack`.
+        """
+        import numpy as np
+
+        if self.kind == "tiff":
+            from .tiff import TiffStack
+
+            return TiffStack(self.path, source="blocks")
+
+        n_bytes = self._span()
+        mm = np.memmap(self.path, dtype=np.uint8, mode="r",
+                       offset=self.offset, shape=(n_bytes,))
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=mm,
+                          strides=self.strides)
+
+    def _span(self) -> int:
+        import numpy as np
+
+        if self.strides is None:
+            return int(np.prod(self.shape)) * self.dtype.itemsize
+        last = sum((n - 1) * s for n, s in zip(self.shape, self.strides))
+        return last + self.dtype.itemsize
+
+
+class ConcatReader:
+    """
+    Picklable description of a frame stack split across files: several
+    `BlockReader`s joined along the first axis (see `concat.ConcatArray`).
+    Blocks inside one file are views of that file's mapping; blocks that
+    cross a file boundary are read with one slice per file.
+
+    Parameters
+    ----------
+    readers: sequence of BlockReader
+        One per file, in order.
+
+    """
+
+    __slots__ = ("readers",)
+
+    def __init__(self, readers: Sequence[BlockReader]):
+        readers = tuple(readers)
+        first = readers[0]
+        for reader in readers[1:]:
+            if reader.dtype != first.dtype or \
+                    reader.shape[1:] != first.shape[1:]:
+                raise ValueError(f"{reader.path} doesn't match {first.path}")
+        self.readers = readers
+
+    def __getstate__(self) -> tuple:
+        return self.readers
+
+    def __setstate__(self, state: tuple) -> None:
+        self.readers = state
+
+    def __dask_tokenize__(self) -> tuple:
+        return (type(self).__name__,
+                [r.__dask_tokenize__() for r in self.readers])
+
+    def __repr__(self) -> str:
+        return f"ConcatReader({len(self.readers)} files, shape={self.shape}, " \
+               f"dtype={str(self.dtype)!r})"
+
+    @property
+    def path(self) -> str:
+        return self.readers[0].path
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        n = sum(r.shape[0] for r in self.readers)
+        return (n, *self.readers[0].shape[1:])
+
+    @property
+    def dtype(self) -> "np.dtype":
+        return self.readers[0].dtype
+
+    def version(self) -> tuple:
+        return tuple(r.version() for r in self.readers)
+
+    def __call__(self, index: Tuple[slice, ...]) -> "np.ndarray":
+        """Return the block of the stack selected by `index`."""
+        return self.open()[index]
+
+    def open(self) -> "ConcatArray":
+        """Return this process's files joined into one array-like."""
+        from .concat import ConcatArray
+
+        return ConcatArray([_get_handle(r) for r in self.readers])
+
+
+def stack_to_dask(
+    reader: Union[BlockReader, ConcatReader],
+    chunks: Any,
+    name: Optional[str] = None,
+) -> "da.Array":
+    """
+    Build a dask array with one small `reader` task per chunk.
+
+    Parameters
+    ----------
+    reader: BlockReader or ConcatReader
+        The stack to read.
+    chunks: optional
+        Anything `dask.array.from_array` accepts as `chunks`.
+    name: str, optional
+        Graph key prefix. Defaults to a token of the reader, the files' sizes
+        and mtimes, and the chunks, so a rewritten file gets new keys.
+
+    """
+    import itertools
+
+    import dask.array as da
+    import numpy as np
+    from dask.array.core import normalize_chunks
+    from dask.base import tokenize
+
+    chunks = normalize_chunks(chunks, reader.shape, dtype=reader.dtype)
+    if name is None:
+        token = tokenize(reader, reader.version(), chunks)
+        name = f"read-frames-{token}"
+
+    bounds = [np.cumsum((0,) + c) for c in chunks]
+    dsk = {}
+    for key in itertools.product(*(range(len(c)) for c in chunks)):
+        index = tuple(
+            slice(int(b[i]), int(b[i + 1])) for b, i in zip(bounds, key)
+        )
+        dsk[(name, *key)] = (reader, index)
+    meta = np.empty((0,) * len(reader.shape), dtype=reader.dtype)
+    return da.Array(dsk, name, chunks, meta=meta)
+
+
+def clear_handles() -> None:
+    """Close and drop this process's cached file mappings."""
+    with _handles_lock:
+        dropped = [handle for _, handle in _handles.values()]
+        _handles.clear()
+    for handle in dropped:
+        _close(handle)
+
+
+def _get_handle(reader: BlockReader) -> Any:
+    global _handles_pid
+
+    st = os.stat(reader.path)
+    version = (st.st_size, st.st_mtime_ns)
+    key = (reader.path, repr(reader.__getstate__()))
+    with _handles_lock:
+        if _handles_pid != os.getpid():
+            # forked: don't reuse (or close) the parent's handles or decoder
+            # threads
+            _handles.clear()
+            _handles_pid = os.getpid()
+        entry = _handles.get(key)
+        if entry is not None and entry[0] == version:
+            _handles.move_to_end(key)
+            return entry[1]
+    with instrument.phase("blocks", "open", reader.path) as ph:
+        handle = reader.open()
+        ph.add_open()
+    dropped = []
+    with _handles_lock:
+        old = _handles.pop(key, None)
+        if old is not None and old[0] == version:
+            # another thread opened it meanwhile: keep theirs, in use
+            _handles[key] = old
+            dropped.append(handle)
+            handle = old[1]
+        else:
+            if old is not None:
+                dropped.append(old[1])  # the file was rewritten
+            _handles[key] = (version, handle)
+        while len(_handles) > _MAX_HANDLES:
+            dropped.append(_handles.popitem(last=False)[1][1])
+    for old_handle in dropped:
+        _close(old_handle)
+    return handle
+
+
+def _close(handle: Any) -> None:
+    # TiffStacks hold an open file and a decoder pool; memmaps close when
+    # their last view is dropped.
+    close = getattr(handle, "close", None)
+    if close is not None:
+        close()
@@ -0,0 +1,262 @@
+"""
+Columnar (Parquet / Arrow IPC) storage for ThorSync data.
+
+`export_sync` streams an Episode h5 file into a columnar file one row group at
+a time, so memory use is bounded by the row-group size. Rows are time ordered
+and Parquet row groups carry min/max statistics, so a reader filtering on
+``time`` skips whole row groups. Digital lines are stored in the smallest
+integer type that holds their values; the dtypes `ThorSyncSource` gives them
+when reading h5 files are kept in the file's schema metadata, and reads cast
+back to them, so both modes return the same dataframe.
+
+`ThorSyncSource` reads these files (or a directory of them) when given a
+``.parquet``/``.arrow`` path or ``format="parquet"``/``"arrow"``, applying
+`columns` as a projection and `time_range` as a pushed-down filter.
+
+Requires pyarrow.
+
+"""
+import json
+import os
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from . import instrument
+from ._version import get_version
+from .common import PathLike
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+    from .thorsync import ThorSyncSource
+
+__all__ = [
+    "COLUMNAR_FORMATS",
+    "export_sync",
+    "infer_format",
+    "read_columnar",
+    "columnar_schema",
+]
+
+# schema metadata key holding the dataframe dtypes of each column
+_DTYPES_KEY = "intake_thorlabs.dtypes"
+
+# format name -> file suffixes
+COLUMNAR_FORMATS = {
+    "parquet": (".parquet", ".pq"),
+    "arrow": (".arrow", ".feather", ".ipc"),
+}
+
+
+def infer_format(path: PathLike) -> str:
+    """Return "parquet", "arrow" or "h5" based on the file suffix."""
+    suffix = os.path.splitext(os.fspath(path))[1].lower()
+    for fmt, suffixes in COLUMNAR_FORMATS.items():
+        if suffix in suffixes:
+            return fmt
+    return "h5"
+
+
+def export_sync(
+    source: Union["ThorSyncSource", PathLike],
+    dest: PathLike,
+    *,
+    format: Optional[str] = None,
+    row_group_size: int = 2 ** 20,
+    compression: Optional[str] = "zstd",
+) -> str:
+    """
+    Stream a ThorSync h5 file into a Parquet or Arrow IPC file.
+
+    Parameters
+    ----------
+    source: ThorSyncSource or path-like
+        Source to export. Its `binary` and `clock_rate` settings apply. A
+        path is opened with `ThorSyncSource` defaults.
+    dest: path-like
+        Output file.
+    format: str, optional
+        "parquet" or "arrow". Inferred from `dest` if not given.
+    row_group_size: int, optional
+        Rows per Parquet row group / Arrow record batch.
+    compression: str, optional
+        Compression codec, or `None`.
+
+    Returns
+    -------
+    dest: str
+
+    """
+    import numpy as np
+    import pyarrow as pa
+
+    from .thorsync import ThorSyncSource
+
+    if not isinstance(source, ThorSyncSource):
+        source = ThorSyncSource(source)
+    dest = os.fspath(dest)
+    format = format or infer_format(dest)
+    if format not in COLUMNAR_FORMATS:
+        raise ValueError(f"unsupported columnar format: {format}")
+
+    views = source.to_memmap()
+    ds_names = source.get_schema()["datasets"]
+    clock_rate = source.clock_rate
+
+    # Compact dtypes, decided up front so every row group shares a schema.
+    dtypes = {"time": np.dtype(np.float64)}
+    for name in ds_names["AI"]:
+        dtypes[name] = views[name].dtype
+    for name in ds_names["DI"]:
+        if name in source.binary:
+            dtypes[name] = np.dtype(np.int8)
+        else:
+            arr = views[name]
+            lo, hi = (int(arr.min()), int(arr.max())) if len(arr) else (0, 0)
+            dtypes[name] = _smallest_int(lo, hi)
+    # dtypes of the h5 driver's dataframe, restored on read
+    logical = {name: str(np.dtype(dt)) for name, dt in dtypes.items()}
+    for name in ds_names["DI"]:
+        if name not in source.binary:
+            logical[name] = str(np.dtype(np.int32))
+
+    metadata = {
+        "clock_rate": str(clock_rate),
+        "source": os.fspath(source.path),
+        "intake_thorlabs": get_version(),
+        _DTYPES_KEY: json.dumps(logical),
+    }
+    schema = pa.schema(
+        [pa.field(name, pa.from_numpy_dtype(dt)) for name, dt in dtypes.items()],
+        metadata=metadata,
+    )
+
+    n_rows = len(views["GCtr"])
+    with instrument.phase(source, "export", dest) as ph:
+        writer = _open_writer(format, dest, schema, compression)
+        try:
+            for start in range(0, n_rows, row_group_size):
+                stop = min(start + row_group_size, n_rows)
+                columns = []
+                for name, dt in dtypes.items():
+                    if name == "time":
+                        arr = views["GCtr"][start:stop] / clock_rate
+                    elif name in source.binary:
+                        arr = np.clip(views[name][start:stop], 0, 1)
+                    else:
+                        arr = views[name][start:stop]
+                    arr = np.ascontiguousarray(arr, dtype=dt)
+                    ph.add_bytes(arr.nbytes)
+                    columns.append(pa.array(arr))
+                table = pa.Table.from_arrays(columns, schema=schema)
+                if format == "parquet":
+                    writer.write_table(table, row_group_size=row_group_size)
+                else:
+                    writer.write_table(table, max_chunksize=row_group_size)
+        finally:
+            writer.close()
+    return dest
+
+
+def columnar_schema(
+    path: Union[PathLike, Sequence[PathLike]],
+    format: str,
+) -> Tuple[Dict[str, "np.dtype"], Optional[int]]:
+    """
+    Return column dtypes and row count of a columnar file, directory or list
+    of files, read from file metadata only.
+    """
+    import numpy as np
+
+    dataset = _dataset(path, format)
+    logical = _logical_dtypes(dataset)
+    dtypes = {
+        field.name: np.dtype(logical.get(field.name,
+                                         field.type.to_pandas_dtype()))
+        for field in dataset.schema
+    }
+    return dtypes, dataset.count_rows()
+
+
+def read_columnar(
+    path: Union[PathLike, Sequence[PathLike]],
+    format: str,
+    columns: Optional[Sequence[str]] = None,
+    time_range: Optional[Tuple[float, float]] = None,
+    recorder: Optional[Any] = None,
+) -> "pd.DataFrame":
+    """
+    Read a columnar file, directory or list of files into a dataframe,
+    reading only `columns` and only the row groups that can overlap
+    `time_range` (``start <= time < stop``).
+    """
+    import pyarrow.dataset as ds
+
+    dataset = _dataset(path, format)
+    expr = None
+    if time_range is not None:
+        start, stop = time_range
+        expr = (ds.field("time") >= start) & (ds.field("time") < stop)
+    table = dataset.to_table(
+        columns=list(columns) if columns is not None else None,
+        filter=expr,
+    )
+    if recorder is not None:
+        recorder.add_bytes(table.nbytes)
+    df = table.to_pandas()
+    logical = _logical_dtypes(dataset)
+    cast = {name: dt for name, dt in logical.items()
+            if name in df.columns and df[name].dtype != dt}
+    return df.astype(cast) if cast else df
+
+
+def _dataset(path: Union[PathLike, Sequence[PathLike]], format: str):
+    import pyarrow.dataset as ds
+
+    if isinstance(path, (list, tuple)):
+        source = [os.fspath(p) for p in path]
+    else:
+        source = os.fspath(path)
+    return ds.dataset(
+        source,
+        format="ipc" if format == "arrow" else format,
+    )
+
+
+def _logical_dtypes(dataset) -> Dict[str, str]:
+    metadata = dataset.schema.metadata or {}
+    raw = metadata.get(_DTYPES_KEY.encode())
+    return json.loads(raw) if raw else {}
+
+
+def _open_writer(format: str, dest: str, schema, compression: Optional[str]):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if format == "parquet":
+        return pq.ParquetWriter(
+            dest,
+            schema,
+            compression=compression or "none",
+            write_statistics=True,
+        )
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    return pa.ipc.new_file(dest, schema, options=options)
+
+
+def _smallest_int(lo: int, hi: int) -> "np.dtype":
+    import numpy as np
+
+    for dt in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dt)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dt)
+    return np.dtype(np.int64)
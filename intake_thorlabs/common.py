@@ -1,20 +1,35 @@
+import fnmatch
 import glob
 import os
+import re
 from os import PathLike
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional, Sequence, Union
 
-from numpy.typing import ArrayLike, DTypeLike
+if TYPE_CHECKING:
+    from numpy.typing import ArrayLike, DTypeLike
 
 __all__ = [
-    "ArrayLike",
-    "DTypeLike",
     "find_file",
     "find_files",
+    "list_dir",
+    "natural_key",
     "PathLike",
+    "resolve_files",
+    "select_file",
+    "select_files",
 ]
 
 
+def __getattr__(name: str):
+    # numpy's typing aliases are resolved on first use so that importing
+    # this module doesn't import numpy.
+    if name in {"ArrayLike", "DTypeLike"}:
+        import numpy.typing
+        return getattr(numpy.typing, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def find_file(
     pathname: PathLike,
     *,
@@ -127,3 +142,127 @@ def find_files(
     if root and root.is_absolute() and not absolute:
         matches = [os.path.relpath(p, root) for p in matches]
     return matches
+
+
+def list_dir(root_dir: PathLike) -> List[str]:
+    """
+    Return the names of the regular files in `root_dir`, sorted.
+
+    A single directory scan whose result can be matched against several
+    patterns with `select_file`.
+    """
+    with os.scandir(os.path.expanduser(root_dir)) as it:
+        return sorted(entry.name for entry in it if entry.is_file())
+
+
+def select_file(
+    pattern: str,
+    names: List[str],
+    *,
+    root_dir: PathLike,
+) -> str:
+    """
+    Return the absolute path of the unique name in `names` matching `pattern`
+    or raise `FileNotFoundError`.
+
+    Parameters
+    ----------
+    pattern: str
+        Glob-style pattern matched against bare file names.
+    names: list of str
+        File names, usually the output of `list_dir(root_dir)`.
+    root_dir: path-like
+        Directory containing the files.
+
+    Returns
+    -------
+    path: str
+        Absolute path of the matching file.
+
+    Raises
+    ------
+    `FileNotFoundError`:
+        Raised if 0 or >1 names match.
+    """
+    matches = fnmatch.filter(names, pattern)
+    if len(matches) != 1:
+        msg = f"{len(matches)} files found for pathname {pattern} with " \
+              f"root_dir {root_dir}"
+        raise FileNotFoundError(msg)
+    root = os.path.abspath(os.path.expanduser(root_dir))
+    return os.path.join(root, matches[0])
+
+
+def select_files(
+    pattern: str,
+    names: List[str],
+    *,
+    root_dir: PathLike,
+) -> List[str]:
+    """
+    Like `select_file`, but return the absolute paths of all names matching
+    `pattern` in natural order (see `natural_key`). Raises
+    `FileNotFoundError` if none match.
+    """
+    matches = sorted(fnmatch.filter(names, pattern), key=natural_key)
+    if not matches:
+        msg = f"0 files found for pathname {pattern} with root_dir {root_dir}"
+        raise FileNotFoundError(msg)
+    root = os.path.abspath(os.path.expanduser(root_dir))
+    return [os.path.join(root, name) for name in matches]
+
+
+def resolve_files(
+    path: Union[PathLike, Sequence[PathLike]],
+    pattern: Optional[str] = None,
+) -> List[str]:
+    """
+    Return the absolute paths of the files making up one dataset.
+
+    Parameters
+    ----------
+    path: path-like or sequence of path-like
+        A file, a glob pattern, a directory (searched with `pattern`), or an
+        explicit sequence of files, kept in the given order.
+    pattern: str, optional
+        Glob-style pattern used when `path` is a directory.
+
+    Returns
+    -------
+    paths: list of str
+        Matching files. Matches of a pattern are in natural order, so split
+        files ('Image_0001_0002.raw', 'Episode010.h5') follow their
+        acquisition order.
+
+    Raises
+    ------
+    `FileNotFoundError`:
+        Raised if no files are found.
+    """
+    if isinstance(path, (list, tuple)):
+        paths = [os.path.abspath(os.path.expanduser(p)) for p in path]
+        for p in paths:
+            if not os.path.isfile(p):
+                raise FileNotFoundError(p)
+        if not paths:
+            raise FileNotFoundError("empty list of files")
+        return paths
+    path = os.path.expanduser(os.fspath(path))
+    if os.path.isdir(path):
+        if not pattern:
+            raise FileNotFoundError(path)
+        paths = find_files(pattern, root_dir=os.path.abspath(path),
+                           absolute=True)
+        where = f"pathname {pattern} with root_dir {path}"
+    else:
+        paths = find_files(os.path.abspath(path))
+        where = f"pathname {path}"
+    if not paths:
+        raise FileNotFoundError(f"0 files found for {where}")
+    return sorted(paths, key=natural_key)
+
+
+def natural_key(name: str) -> List[Union[int, str]]:
+    """Sort key that orders embedded numbers numerically ('a2' < 'a10')."""
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r"(\d+)", name)]
@@ -0,0 +1,220 @@
+"""
+Virtual concatenation of arrays split across files.
+
+Long acquisitions are split by ThorImage and ThorSync into several files.
+`ConcatArray` presents the per-file arrays (memmaps, TIFF stacks, h5 views)
+as one array along the first axis without copying them into a combined
+file. A precomputed offset index maps any index or range straight to the
+file(s) holding it; a range is read with one slice per file, and a range
+inside one file is returned as that file's view, still without a copy.
+
+"""
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    List,
+    Sequence,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+    from numpy.typing import DTypeLike
+
+__all__ = [
+    "ConcatArray",
+]
+
+
+class ConcatArray:
+    """
+    Read-only concatenation of array-likes along their first axis.
+
+    Parameters
+    ----------
+    parts: sequence of array-like
+        Arrays with equal dtypes and trailing dimensions, in order. Each
+        must support `len` and indexing along the first axis.
+
+    Attributes
+    ----------
+    offsets: ndarray
+        Index of the first element of each part, followed by the total
+        length.
+
+    """
+
+    def __init__(self, parts: Sequence[Any]):
+        import numpy as np
+
+        parts = list(parts)
+        if not parts:
+            raise ValueError("nothing to concatenate")
+        first = parts[0]
+        for part in parts[1:]:
+            if part.dtype != first.dtype or \
+                    tuple(part.shape[1:]) != tuple(first.shape[1:]):
+                raise ValueError(
+                    f"can't concatenate {part.dtype}{tuple(part.shape)} "
+                    f"with {first.dtype}{tuple(first.shape)}"
+                )
+        self.parts = parts
+        self.offsets = np.concatenate(
+            [[0], np.cumsum([len(p) for p in parts])]
+        ).astype(np.int64)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return (int(self.offsets[-1]), *self.parts[0].shape[1:])
+
+    @property
+    def dtype(self) -> "np.dtype":
+        return self.parts[0].dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def nbytes(self) -> int:
+        import numpy as np
+
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __repr__(self) -> str:
+        return f"ConcatArray({len(self.parts)} parts, shape={self.shape}, " \
+               f"dtype={str(self.dtype)!r})"
+
+    def __array__(self, dtype: "DTypeLike" = None) -> "np.ndarray":
+        import numpy as np
+
+        out = self[:]
+        return out if dtype is None else np.asarray(out, dtype=dtype)
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """Return (part number, index within part) of element `index`."""
+        import numpy as np
+
+        part = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        return part, int(index - self.offsets[part])
+
+    def __getitem__(self, key: Any) -> "np.ndarray":
+        import numpy as np
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = key[0], key[1:]
+        n = len(self)
+        if first is Ellipsis:
+            return self[:][key]
+        if isinstance(first, (int, np.integer)):
+            index = int(first) + n if first < 0 else int(first)
+            if not 0 <= index < n:
+                raise IndexError(f"index {first} out of range")
+            part, local = self.locate(index)
+            return self.parts[part][(local, *rest)]
+        if isinstance(first, slice):
+            return self._read_slice(first, rest)
+        return self._read_indices(np.arange(n)[first], rest)
+
+    def _read_slice(self, key: slice, rest: Tuple) -> "np.ndarray":
+        import numpy as np
+
+        start, stop, step = key.indices(len(self))
+        if step < 0:
+            # read forwards, then reverse
+            count = len(range(start, stop, step))
+            if not count:
+                return self._read_slice(slice(0, 0), rest)
+            last = start + (count - 1) * step
+            forward = self._read_slice(slice(last, start + 1, -step), rest)
+            return forward[::-1]
+        pieces = self._pieces(start, stop, step)
+        if len(pieces) == 1:
+            part, local, _ = pieces[0]
+            return self.parts[part][(local, *rest)]
+        blocks = [self.parts[part][(local, *rest)]
+                  for part, local, _ in pieces]
+        if not blocks:
+            probe = self.parts[0][(slice(0, 0), *rest)]
+            return np.asarray(probe)
+        return np.concatenate(blocks)
+
+    def _pieces(self, start: int, stop: int, step: int) -> List[Tuple]:
+        """One (part, local slice, count) per part the range touches."""
+        pieces = []
+        if start >= stop:
+            return pieces
+        first, _ = self.locate(start)
+        for part in range(first, len(self.parts)):
+            lo, hi = int(self.offsets[part]), int(self.offsets[part + 1])
+            if lo >= stop:
+                break
+            begin = start
+            if start < lo:
+                # first index >= lo on the step grid
+                begin = start + -(-(lo - start) // step) * step
+            end = min(stop, hi)
+            if begin >= end:
+                continue
+            local = slice(begin - lo, end - lo, step)
+            pieces.append((part, local, len(range(begin, end, step))))
+        return pieces
+
+    def _read_indices(self, indices: "np.ndarray", rest: Tuple) -> "np.ndarray":
+        import numpy as np
+
+        indices = np.asarray(indices, dtype=np.int64)
+        parts = np.searchsorted(self.offsets, indices, side="right") - 1
+        blocks = []
+        positions = []
+        for part in np.unique(parts):
+            where = np.flatnonzero(parts == part)
+            local = indices[where] - self.offsets[part]
+            blocks.append(np.asarray(self.parts[part][(local, *rest)]))
+            positions.append(where)
+        if not blocks:
+            return np.asarray(self.parts[0][(slice(0, 0), *rest)])
+        out = np.empty((len(indices), *blocks[0].shape[1:]),
+                       dtype=blocks[0].dtype)
+        for where, block in zip(positions, blocks):
+            out[where] = block
+        return out
+
+    def min(self, axis: Any = None, **kwargs: Any) -> Any:
+        """Minimum over all elements, reduced part by part."""
+        import numpy as np
+
+        if axis is not None:
+            raise NotImplementedError("only axis=None is supported")
+        return np.min([np.min(p) for p in self.parts if len(p)])
+
+    def max(self, axis: Any = None, **kwargs: Any) -> Any:
+        """Maximum over all elements, reduced part by part."""
+        import numpy as np
+
+        if axis is not None:
+            raise NotImplementedError("only axis=None is supported")
+        return np.max([np.max(p) for p in self.parts if len(p)])
+
+    def searchsorted(self, v: Any, side: str = "left", sorter: Any = None) -> Any:
+        """
+        `numpy.searchsorted` for a sorted 1-d concatenation, searching only
+        the part that can hold each value.
+        """
+        import numpy as np
+
+        if sorter is not None:
+            raise NotImplementedError("sorter is not supported")
+        values = np.asarray(v)
+        firsts = np.array([p[0] for p in self.parts if len(p)])
+        starts = self.offsets[:-1][[len(p) > 0 for p in self.parts]]
+        parts = [p for p in self.parts if len(p)]
+        out = np.empty(values.shape, dtype=np.intp)
+        for pos, value in np.ndenumerate(values):
+            i = max(int(np.searchsorted(firsts, value, side=side)) - 1, 0)
+            out[pos] = starts[i] + np.searchsorted(parts[i], value, side=side)
+        return out if values.ndim else int(out[()])
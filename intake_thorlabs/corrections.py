@@ -0,0 +1,310 @@
+"""
+Read-time corrections for ThorImage frame stacks.
+
+`Corrections` applies bidirectional line-phase correction, orientation flips,
+dark-offset subtraction and dtype conversion to a block of frames in a single
+vectorized pass: flips are folded into the output view, the phase shift into
+the slices of the odd lines, and the subtraction writes straight into the
+output array. Rigid motion correction (see `registration`) is applied last,
+from cached per-frame shifts; in dask graphs each task receives only its own
+block's shifts. A catalog configures it with a plain mapping::
+
+    args:
+      corrections:
+        bidi_phase: auto
+        flip: y
+        dark_offset: 120
+        dtype: float32
+        register:
+          max_shift: 20
+
+"""
+import hashlib
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+if TYPE_CHECKING:
+    import dask.array as da
+    import numpy as np
+    from numpy.typing import DTypeLike
+
+__all__ = [
+    "Corrections",
+    "estimate_bidi_phase",
+]
+
+
+class Corrections:
+    """
+    Fused per-block correction pipeline.
+
+    Parameters
+    ----------
+    bidi_phase: int or "auto", optional
+        Number of pixels odd (return-scan) lines are shifted along x to line
+        them up with even lines. "auto" must be resolved with
+        `estimate_bidi_phase` before the pipeline is applied.
+    flip: str, optional
+        Any of "x", "y" or "xy". Flips are applied after phase correction,
+        i.e. the phase refers to lines in acquisition order.
+    dark_offset: number, optional
+        Value subtracted from every pixel.
+    dtype: dtype-like, optional
+        Output dtype. Integer outputs are clipped to the dtype's range.
+    register: bool or mapping, optional
+        If set, frames are shifted onto a reference image after the other
+        corrections. A mapping is passed as keyword arguments to
+        `registration.load_or_compute_shifts`. Shifts are computed (or loaded
+        from their sidecar) by `resolve`.
+
+    """
+
+    def __init__(
+        self,
+        bidi_phase: Union[int, str] = 0,
+        flip: Optional[str] = None,
+        dark_offset: float = 0,
+        dtype: "DTypeLike" = "float32",
+        register: Union[bool, Mapping[str, Any]] = False,
+    ):
+        import numpy as np
+
+        if isinstance(bidi_phase, str) and bidi_phase != "auto":
+            raise ValueError(f"invalid bidi_phase: {bidi_phase}")
+        flip = (flip or "").lower()
+        if set(flip) - {"x", "y"}:
+            raise ValueError(f"invalid flip: {flip}")
+        self.bidi_phase = bidi_phase
+        self.flip = flip
+        self.dark_offset = dark_offset
+        self.dtype = np.dtype(dtype)
+        self.register = register
+        self.shifts = None  # (t, 2) registration shifts, set by `resolve`
+        self._scratch = threading.local()
+
+    @classmethod
+    def from_config(cls, config: Optional[Mapping[str, Any]]) -> "Corrections":
+        """Build a pipeline from a catalog mapping. Unknown keys raise."""
+        config = dict(config or {})
+        known = {"bidi_phase", "flip", "dark_offset", "dtype", "register"}
+        unknown = set(config) - known
+        if unknown:
+            raise ValueError(f"unknown corrections: {sorted(unknown)}")
+        return cls(**config)
+
+    def resolve(
+        self,
+        frames: "np.ndarray",
+        path: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "Corrections":
+        """
+        Estimate any "auto" parameters from a sample of `frames`, and load or
+        compute registration shifts if requested. Registration needs `path`,
+        the raw file the shifts sidecar belongs to. Extra arguments are
+        passed to `estimate_bidi_phase`.
+        """
+        from .registration import load_or_compute_shifts
+
+        if self.bidi_phase == "auto":
+            self.bidi_phase = estimate_bidi_phase(frames, **kwargs)
+        if self.register and self.shifts is None:
+            if path is None:
+                raise ValueError("registration requires the raw file path")
+            options = self.register if isinstance(self.register, Mapping) \
+                else {}
+            # Shifts are estimated on otherwise corrected frames.
+            self.shifts = load_or_compute_shifts(
+                path, frames, transform=self, **options,
+            )
+        return self
+
+    def __call__(
+        self,
+        block: "np.ndarray",
+        start: int = 0,
+        block_info: Optional[Mapping] = None,
+        shifts: Optional["np.ndarray"] = None,
+    ) -> "np.ndarray":
+        """
+        Correct a (t, y, x) block of frames and return a new array.
+
+        `start` is the index of the block's first frame, used to look up
+        registration shifts. When used with `dask.array.map_blocks` it is
+        taken from `block_info`. `shifts`, the block's own (t, 2) shifts,
+        takes precedence over the pipeline's.
+        """
+        import numpy as np
+
+        from .registration import apply_shifts
+
+        if block_info is not None:
+            start = block_info[0]["array-location"][0][0]
+
+        if self.bidi_phase == "auto":
+            raise RuntimeError("bidi_phase is 'auto'; call resolve() first")
+
+        out = np.empty(block.shape, dtype=self.dtype)
+        if self.dtype.kind == "f":
+            target = out
+        else:
+            # Integer outputs go through a float scratch buffer so the
+            # subtraction can't wrap around before clipping.
+            target = self._scratch_buffer(block.shape)
+
+        # Write through flipped views of the target so the phase shift below
+        # works in acquisition coordinates.
+        view = target
+        if "y" in self.flip:
+            view = view[..., ::-1, :]
+        if "x" in self.flip:
+            view = view[..., ::-1]
+
+        dark = self.dark_offset
+        p = int(self.bidi_phase)
+        kw = dict(dtype=target.dtype, casting="unsafe")
+        np.subtract(block[..., 0::2, :], dark, out=view[..., 0::2, :], **kw)
+        src, dst = block[..., 1::2, :], view[..., 1::2, :]
+        if p > 0:
+            np.subtract(src[..., :-p], dark, out=dst[..., p:], **kw)
+            dst[..., :p] = 0
+        elif p < 0:
+            np.subtract(src[..., -p:], dark, out=dst[..., :p], **kw)
+            dst[..., p:] = 0
+        else:
+            np.subtract(src, dark, out=dst, **kw)
+
+        if target is not out:
+            info = np.iinfo(self.dtype)
+            np.clip(target, info.min, info.max, out=target)
+            np.copyto(out, target, casting="unsafe")
+
+        if shifts is None and self.shifts is not None:
+            shifts = self.shifts[start:start + len(out)]
+        if shifts is not None:
+            apply_shifts(out, shifts)
+        return out
+
+    def to_dask(self, arr: "da.Array") -> "da.Array":
+        """
+        Apply the pipeline lazily to a (t, y, x) dask array.
+
+        Registration shifts are passed as a dask array chunked along t like
+        `arr`, so each task carries only its block's shifts instead of a
+        copy of the whole array.
+        """
+        import copy
+
+        import dask.array as da
+        import numpy as np
+
+        pipeline = copy.copy(self)
+        pipeline.shifts = None
+        if self.shifts is None:
+            return arr.map_blocks(pipeline, dtype=self.dtype)
+        shifts = da.from_array(self.shifts, chunks=(arr.chunks[0], 2))
+        index = tuple(range(arr.ndim))
+        return da.blockwise(
+            _correct_block, index,
+            arr, index,
+            shifts, (0, arr.ndim),
+            pipeline, None,
+            concatenate=True,
+            dtype=self.dtype,
+            meta=np.empty((0,) * arr.ndim, dtype=self.dtype),
+        )
+
+    def __dask_tokenize__(self) -> Tuple:
+        shifts = None
+        if self.shifts is not None:
+            shifts = hashlib.sha1(self.shifts.tobytes()).hexdigest()
+        return (type(self).__name__, self.bidi_phase, self.flip,
+                self.dark_offset, str(self.dtype), shifts)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_scratch"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._scratch = threading.local()
+
+    def __repr__(self) -> str:
+        return f"Corrections(bidi_phase={self.bidi_phase!r}, " \
+               f"flip={self.flip!r}, dark_offset={self.dark_offset!r}, " \
+               f"dtype={str(self.dtype)!r})"
+
+    def _scratch_buffer(self, shape: Tuple[int, ...]) -> "np.ndarray":
+        import numpy as np
+
+        # One buffer per thread, reused across blocks of the same shape.
+        buf = getattr(self._scratch, "buf", None)
+        if buf is None or buf.shape != shape:
+            buf = self._scratch.buf = np.empty(shape, dtype=np.float32)
+        return buf
+
+
+def _correct_block(
+    block: "np.ndarray",
+    shifts: "np.ndarray",
+    pipeline: Corrections,
+) -> "np.ndarray":
+    return pipeline(block, shifts=shifts)
+
+
+def estimate_bidi_phase(
+    frames: "np.ndarray",
+    max_phase: int = 16,
+    n_frames: int = 100,
+) -> int:
+    """
+    Estimate the bidirectional scan phase of a frame stack.
+
+    The mean of up to `n_frames` evenly spaced frames is split into even and
+    odd lines, which are cross-correlated along x with FFTs. The returned
+    value is the shift to pass as `Corrections(bidi_phase=...)`.
+
+    Parameters
+    ----------
+    frames: array-like
+        (t, y, x) stack, e.g. a memmap. Only the sampled frames are read.
+    max_phase: int, optional
+        Largest shift (in pixels) considered.
+    n_frames: int, optional
+        Number of frames averaged.
+
+    Returns
+    -------
+    phase: int
+
+    """
+    import numpy as np
+
+    n_total = len(frames)
+    n = max(min(n_frames, n_total), 1)
+    indices = np.unique(np.linspace(0, n_total - 1, n).astype(int))
+    img = np.zeros(frames.shape[1:], dtype=np.float64)
+    for i in indices:
+        img += frames[i]
+    img /= len(indices)
+
+    n_lines = img.shape[0] // 2
+    even = img[0:2 * n_lines:2]
+    odd = img[1:2 * n_lines:2]
+    even = even - even.mean(axis=1, keepdims=True)
+    odd = odd - odd.mean(axis=1, keepdims=True)
+
+    width = img.shape[1]
+    spec = np.fft.rfft(even, axis=1) * np.conj(np.fft.rfft(odd, axis=1))
+    xcorr = np.fft.irfft(spec.sum(axis=0), n=width)
+    max_phase = min(max_phase, width // 2 - 1)
+    lags = np.arange(-max_phase, max_phase + 1)
+    return int(lags[np.argmax(xcorr[lags % width])])
@@ -0,0 +1,291 @@
+import fnmatch
+import os
+from numbers import Number
+from typing import (
+    TYPE_CHECKING,
+    ClassVar,
+    Container,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+)
+
+from intake.source.base import DataSource, Schema
+
+from . import instrument
+from ._version import get_version
+from .common import *
+from .thorimage import ThorImageArraySource, ThorImageMetadataSource
+from .thorsync import ThorSyncSource
+
+if TYPE_CHECKING:
+    import dask.array as da
+    import pandas as pd
+
+__all__ = [
+    "ThorExperimentSource",
+]
+
+
+class ThorExperimentSource(DataSource):
+    """
+    Composite driver for a whole experiment folder.
+
+    The folder is scanned once and Experiment.xml is parsed once; the image
+    array, sync table and metadata are then exposed as member sources that
+    share that work. The schema holds each member's schema under "image" and
+    "sync" (`None` if the member is absent). Member sources (and the file
+    handles they open) are owned by the composite and closed with it.
+
+    Parameters
+    ----------
+    path: path-like
+        Experiment folder containing Experiment.xml, and optionally raw
+        image and ThorSync h5 files. Image or sync data split across
+        several matching files is concatenated (see `paths`).
+    chunks: int, optional
+        Passed to the image member. See `ThorImageArraySource`.
+    binary: iterable of str, optional
+        Passed to the sync member. See `ThorSyncSource`.
+    clock_rate: number, optional
+        Passed to the sync member. See `ThorSyncSource`.
+    metadata_pattern, image_pattern, sync_pattern: str, optional
+        File name patterns used to pick each member's file out of the folder.
+
+    """
+
+    name: ClassVar[str] = "thorexperiment"
+    container: ClassVar[str] = "python"
+    version: ClassVar[str] = get_version()
+    partition_access: ClassVar[bool] = False
+
+    def __init__(
+        self,
+        path: PathLike,
+        *,
+        chunks: Optional[int] = None,
+        binary: Optional[Container[str]] = None,
+        clock_rate: Number = 20_000_000,
+        metadata_pattern: str = "Experiment.xml",
+        image_pattern: str = "Image*.raw",
+        sync_pattern: str = "Episode*.h5",
+        metadata: Optional[Mapping] = None,
+    ):
+        super().__init__(metadata=metadata)
+        self._path = os.fspath(path)
+        self.path = None
+        self.chunks = chunks
+        self.binary = binary
+        self.clock_rate = clock_rate
+        self.metadata_pattern = metadata_pattern
+        self.image_pattern = image_pattern
+        self.sync_pattern = sync_pattern
+
+        self._files = None  # member name -> resolved path or None
+        self._paths = None  # member name -> list of resolved paths
+        self._metadata_source = None
+        self._image = None
+        self._sync = None
+
+    @property
+    def files(self) -> Dict[str, Optional[str]]:
+        """
+        Resolved paths of the metadata, image and sync files. For members
+        split across several files, the first one.
+        """
+        self._load_metadata()
+        return dict(self._files)
+
+    @property
+    def paths(self) -> Dict[str, List[str]]:
+        """All resolved files of each member, in order (empty if absent)."""
+        self._load_metadata()
+        return {member: list(paths) for member, paths in self._paths.items()}
+
+    @property
+    def metadata_source(self) -> ThorImageMetadataSource:
+        self._load_metadata()
+        return self._metadata_source
+
+    @property
+    def image(self) -> ThorImageArraySource:
+        self._load_metadata()
+        return self._member("image")
+
+    @property
+    def sync(self) -> ThorSyncSource:
+        self._load_metadata()
+        return self._member("sync")
+
+    def get_schema(self) -> Schema:
+        self._load_metadata()
+        return self._schema
+
+    def to_dict(self) -> Mapping:
+        return self.metadata_source.to_dict()
+
+    async def to_dict_async(self) -> Mapping:
+        """`to_dict`, run on the shared "io" executor (see `aio`)."""
+        from .aio import get_executor
+
+        return await get_executor("io").run(self.to_dict)
+
+    async def get_schema_async(self) -> Schema:
+        """
+        `get_schema`, with the folder scan, XML parse and image schema run
+        on the shared "io" executor and the sync schema on the "h5" one
+        (see `aio`).
+        """
+        import asyncio
+
+        from .aio import get_executor
+
+        if self._schema is None:
+            io = get_executor("io")
+            schema = await io.run(self._scan)
+            members = [m for m in ("image", "sync") if schema["paths"][m]]
+            jobs = []
+            for member in members:
+                src = self._member(member)
+                if member == "sync":
+                    jobs.append(src.get_schema_async())
+                else:
+                    jobs.append(io.run(src.get_schema))
+            for member, member_schema in zip(
+                members, await asyncio.gather(*jobs),
+            ):
+                schema[member] = _member_schema(member_schema)
+            self._schema = schema
+        return self._schema
+
+    def to_dask(self) -> "da.Array":
+        return self.image.to_dask()
+
+    def to_dataframe(self) -> "pd.DataFrame":
+        return self.sync.read()
+
+    def _close(self) -> None:
+        for src in (self._metadata_source, self._image, self._sync):
+            if src is not None:
+                src.close()
+        self._schema = None
+        self._files = None
+        self._paths = None
+        self._metadata_source = None
+        self._image = None
+        self._sync = None
+
+    def _get_partition(self, i) -> Mapping:
+        """
+        Return all members: metadata dict, image dask array and sync
+        dataframe. Missing members are `None`.
+        """
+        self._load_metadata()
+        out = {"metadata": self.to_dict(), "image": None, "sync": None}
+        if self._files["image"]:
+            out["image"] = self.to_dask()
+        if self._files["sync"]:
+            out["sync"] = self.to_dataframe()
+        return out
+
+    def _get_schema(self) -> Schema:
+        schema = self._scan()
+        for member in ("image", "sync"):
+            if schema["paths"][member]:
+                src = self._member(member)
+                schema[member] = _member_schema(src.get_schema())
+        return schema
+
+    def _scan(self) -> Schema:
+        """
+        Resolve every member's files and parse Experiment.xml. Returns the
+        schema with the member schemas still `None`.
+        """
+
+        # One directory scan resolves every member's file.
+        with instrument.phase(self, "find_file", self._path):
+            if not os.path.isdir(self._path):
+                raise NotADirectoryError(self._path)
+            self.path = os.path.abspath(os.path.expanduser(self._path))
+            names = list_dir(self.path)
+            paths = {
+                "metadata": [select_file(
+                    self.metadata_pattern, names, root_dir=self.path,
+                )],
+            }
+            for member in ("image", "sync"):
+                # image and sync files are optional, and may be split
+                # across several files.
+                pattern = getattr(self, f"{member}_pattern")
+                if not fnmatch.filter(names, pattern):
+                    paths[member] = []
+                    continue
+                paths[member] = select_files(
+                    pattern, names, root_dir=self.path,
+                )
+        self._paths = paths
+        files = {m: p[0] if p else None for m, p in paths.items()}
+        self._files = files
+
+        # One XML parse, shared with the image member.
+        md_source = ThorImageMetadataSource(files["metadata"], resolved=True)
+        self._metadata_source = md_source
+        md = md_source.to_dict()
+
+        # The composite has no shape or dtype of its own; those of its
+        # members are kept under their names.
+        return Schema(
+            dtype=None,
+            shape=None,
+            npartitions=1,
+            path=self.path,
+            files=dict(files),
+            paths={m: tuple(p) for m, p in paths.items()},
+            image=None,
+            sync=None,
+            extra_metadata=md,
+        )
+
+    def _load_metadata(self) -> None:
+        if self._schema is None:
+            self._schema = self._get_schema()
+
+    def _member(self, member: str) -> DataSource:
+        """The image or sync member source, created on first use."""
+        src = getattr(self, f"_{member}")
+        if src is not None:
+            return src
+        paths = self._member_paths(member)
+        if member == "image":
+            src = ThorImageArraySource(
+                paths,
+                chunks=self.chunks,
+                metadata_source=self._metadata_source,
+                resolved=True,
+            )
+        else:
+            src = ThorSyncSource(
+                paths,
+                binary=self.binary,
+                clock_rate=self.clock_rate,
+                resolved=True,
+            )
+        setattr(self, f"_{member}", src)
+        return src
+
+    def _member_paths(self, member: str) -> List[str]:
+        paths = self._paths[member]
+        if not paths:
+            pattern = getattr(self, f"{member}_pattern")
+            msg = f"0 files found for pathname {pattern} with " \
+                  f"root_dir {self.path}"
+            raise FileNotFoundError(msg)
+        return list(paths)
+
+
+def _member_schema(schema: Schema) -> Dict:
+    """A member's schema, less the metadata already held by the composite."""
+    schema = dict(schema)
+    schema.pop("extra_metadata", None)
+    return schema
@@ -0,0 +1,301 @@
+"""
+Low-latency random frame access for interactive viewers.
+
+`FrameReader` serves single frames straight from an array-like (usually the
+raw file's memmap) without building a dask graph. Recently used frames are
+kept in a byte-bounded LRU cache, and when frames are requested in sequence
+the reader prefetches ahead of the playhead, in the direction of playback, on
+a background thread. The read-ahead window doubles while access stays
+sequential and resets on a jump.
+
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
+
+from . import instrument
+
+if TYPE_CHECKING:
+    import numpy as np
+
+__all__ = [
+    "FrameCache",
+    "FrameReader",
+]
+
+
+class FrameCache:
+    """
+    Byte-bounded LRU cache of frames keyed on frame index.
+
+    Parameters
+    ----------
+    max_bytes: int
+        Total size of cached frames above which the least recently used
+        frames are dropped.
+
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._frames: "OrderedDict[int, np.ndarray]" = OrderedDict()
+
+    def __contains__(self, index: int) -> bool:
+        with self._lock:
+            return index in self._frames
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._frames)
+
+    def get(self, index: int) -> Optional["np.ndarray"]:
+        with self._lock:
+            frame = self._frames.get(index)
+            if frame is not None:
+                self._frames.move_to_end(index)
+            return frame
+
+    def put(self, index: int, frame: "np.ndarray") -> None:
+        if frame.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._frames.pop(index, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._frames[index] = frame
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes:
+                _, dropped = self._frames.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+
+class FrameReader:
+    """
+    Random frame access with an LRU frame cache and adaptive read-ahead.
+
+    Parameters
+    ----------
+    array: array-like
+        Frame stack indexed along the first axis, e.g. an `np.memmap`.
+    cache_bytes: int, optional
+        Size of the frame cache in bytes.
+    readahead: int, optional
+        Maximum number of frames prefetched ahead of the playhead. 0 disables
+        read-ahead.
+    source: optional
+        Source (or name) to record instrumentation against.
+    transform: callable, optional
+        Applied to each block of frames as it is read, before caching, e.g.
+        a `Corrections` pipeline. Called with the block and, as `start`, the
+        index of its first frame.
+
+    """
+
+    def __init__(
+        self,
+        array: Any,
+        cache_bytes: int = 256 * 2 ** 20,
+        readahead: int = 64,
+        source: Optional[Any] = None,
+        transform: Optional[Callable[..., "np.ndarray"]] = None,
+    ):
+        self.array = array
+        self.transform = transform
+        self.cache = FrameCache(cache_bytes)
+        self.readahead = max(int(readahead), 0)
+        self.source = source if source is not None else "frames"
+        self._n_frames = len(array)
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._last = None
+        self._direction = 0
+        self._window = 0
+
+    def __len__(self) -> int:
+        return self._n_frames
+
+    def get_frame(self, index: int) -> "np.ndarray":
+        """
+        Return frame `index` as a read-only array.
+        """
+        index = self._normalize(index)
+        with instrument.phase(self.source, "get_frame") as ph:
+            frame = self.cache.get(index)
+            if frame is None:
+                with self._lock:
+                    future = self._pending.get(index)
+                if future is not None:
+                    # Already being prefetched; don't read it twice.
+                    try:
+                        future.result()
+                    except Exception:
+                        pass
+                    frame = self.cache.get(index)
+                if frame is None:
+                    ph.miss()
+                    frame = self._read(index, index + 1, ph)[0]
+                else:
+                    ph.hit()
+            else:
+                ph.hit()
+        self._prefetch(index)
+        return frame
+
+    def get_frames(self, key: Union[slice, Sequence[int]]) -> "np.ndarray":
+        """
+        Return the frames selected by a slice or a sequence of indices,
+        stacked into a new array.
+        """
+        import numpy as np
+
+        if isinstance(key, slice):
+            indices = list(range(*key.indices(self._n_frames)))
+        else:
+            indices = [self._normalize(i) for i in key]
+        frame_shape = tuple(self.array.shape[1:])
+        dtype = self.array.dtype
+        if self.transform is not None:
+            dtype = getattr(self.transform, "dtype", dtype)
+        out = np.empty((len(indices), *frame_shape), dtype=dtype)
+        with instrument.phase(self.source, "get_frames") as ph:
+            missing = []
+            for pos, index in enumerate(indices):
+                frame = self.cache.get(index)
+                if frame is None:
+                    missing.append((pos, index))
+                else:
+                    out[pos] = frame
+            ph.hit(len(indices) - len(missing))
+            ph.miss(len(missing))
+            # Read each run of consecutive missing frames with one slice,
+            # straight into `out`, and cache copies of as many of its last
+            # frames as the cache can hold.
+            n_cached = self.cache.max_bytes // max(out[0].nbytes, 1) \
+                if len(out) else 0
+            for run in _runs(missing):
+                start, stop = run[0][1], run[-1][1] + 1
+                out[[pos for pos, _ in run]] = self._read_block(start, stop, ph)
+                for pos, index in run[len(run) - min(n_cached, len(run)):]:
+                    self._cache(index, out[pos])
+        if indices:
+            self._prefetch(indices[-1])
+        return out
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=False)
+        self.cache.clear()
+
+    def _normalize(self, index: int) -> int:
+        index = int(index)
+        if index < 0:
+            index += self._n_frames
+        if not 0 <= index < self._n_frames:
+            raise IndexError(f"frame {index} out of range")
+        return index
+
+    def _read(self, start: int, stop: int, recorder) -> List["np.ndarray"]:
+        block = self._read_block(start, stop, recorder)
+        return [self._cache(start + offset, block[offset])
+                for offset in range(stop - start)]
+
+    def _read_block(self, start: int, stop: int, recorder) -> "np.ndarray":
+        """Frames `start:stop`, transformed. May be a view of the array."""
+        import numpy as np
+
+        block = np.asarray(self.array[start:stop])
+        recorder.add_bytes(block.nbytes)
+        if self.transform is not None:
+            block = self.transform(block, start=start)
+        return block
+
+    def _cache(self, index: int, frame: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        # A copy, so a cached frame doesn't keep its whole read block (or
+        # the file mapping) alive and the cache bound holds.
+        frame = np.array(frame)
+        frame.flags.writeable = False
+        self.cache.put(index, frame)
+        return frame
+
+    def _prefetch(self, index: int) -> None:
+        if not self.readahead:
+            return
+        with self._lock:
+            last, self._last = self._last, index
+            step = 0 if last is None else index - last
+            if step in (1, -1) and step == self._direction:
+                self._window = min(max(self._window * 2, 2), self.readahead)
+            else:
+                self._direction = step if step in (1, -1) else 0
+                self._window = 0
+            if not self._window:
+                return
+
+            if self._direction > 0:
+                start = index + 1
+                stop = min(index + 1 + self._window, self._n_frames)
+            else:
+                start = max(index - self._window, 0)
+                stop = index
+            wanted = [
+                i for i in range(start, stop)
+                if i not in self._pending and i not in self.cache
+            ]
+            if not wanted:
+                return
+            start, stop = wanted[0], wanted[-1] + 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="intake_thorlabs-readahead"
+                )
+            future = self._executor.submit(self._readahead, start, stop)
+            for i in range(start, stop):
+                self._pending[i] = future
+            future.add_done_callback(
+                lambda fut, rng=range(start, stop): self._done(fut, rng)
+            )
+
+    def _readahead(self, start: int, stop: int) -> None:
+        with instrument.phase(self.source, "readahead") as ph:
+            self._read(start, stop, ph)
+
+    def _done(self, future: Future, indices: Iterable[int]) -> None:
+        with self._lock:
+            for i in indices:
+                if self._pending.get(i) is future:
+                    del self._pending[i]
+
+
+def _runs(items: List[tuple]) -> List[List[tuple]]:
+    """Split (position, index) pairs into runs of consecutive indices."""
+    runs = []
+    for item in items:
+        if runs and item[1] == runs[-1][-1][1] + 1:
+            runs[-1].append(item)
+        else:
+            runs.append([item])
+    return runs
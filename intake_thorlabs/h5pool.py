@@ -0,0 +1,230 @@
+"""
+Process-wide pool of open, read-only h5py files.
+
+Opening an HDF5 file and walking its B-trees is expensive on network storage,
+so drivers borrow handles from a shared pool instead of reopening the file for
+every schema, partition or window read. Handles also keep their chunk cache
+warm between reads.
+
+Handles are keyed on (path, mtime, size) so a file rewritten on disk gets a
+fresh handle. Idle handles are closed in least-recently-used order once the
+pool holds more than `max_handles`; handles in use are never closed.
+
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterator,
+    Optional,
+    Tuple,
+)
+
+from . import instrument
+from .common import PathLike
+
+if TYPE_CHECKING:
+    import h5py
+
+__all__ = [
+    "H5HandlePool",
+    "configure_pool",
+    "get_pool",
+]
+
+_Key = Tuple[str, int, int]
+
+
+class _Entry:
+
+    __slots__ = ("file", "refs")
+
+    def __init__(self, file: "h5py.File"):
+        self.file = file
+        self.refs = 0
+
+
+class H5HandlePool:
+    """
+    Thread-safe LRU pool of open h5py files.
+
+    Parameters
+    ----------
+    max_handles: int, optional
+        Maximum number of idle handles kept open.
+    rdcc_nbytes: int, optional
+        Size in bytes of each file's raw data chunk cache.
+    rdcc_nslots: int, optional
+        Number of chunk slots in each file's chunk cache.
+    rdcc_w0: float, optional
+        Chunk cache preemption policy (0 to 1).
+
+    """
+
+    def __init__(
+        self,
+        max_handles: int = 16,
+        rdcc_nbytes: int = 64 * 2 ** 20,
+        rdcc_nslots: int = 10007,
+        rdcc_w0: float = 0.75,
+    ):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[_Key, _Entry]" = OrderedDict()
+        self._pid = os.getpid()
+        self.max_handles = max_handles
+        self.rdcc_nbytes = rdcc_nbytes
+        self.rdcc_nslots = rdcc_nslots
+        self.rdcc_w0 = rdcc_w0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def configure(self, **kwargs: Any) -> None:
+        """
+        Update pool settings. Chunk-cache settings apply to files opened
+        afterwards; lowering `max_handles` evicts idle handles immediately.
+        """
+        with self._lock:
+            for name, val in kwargs.items():
+                if name not in {
+                    "max_handles", "rdcc_nbytes", "rdcc_nslots", "rdcc_w0",
+                }:
+                    raise TypeError(f"unknown pool setting: {name}")
+                setattr(self, name, val)
+            self._evict()
+
+    @contextmanager
+    def acquire(
+        self,
+        path: PathLike,
+        recorder: Optional[Any] = None,
+    ) -> Iterator["h5py.File"]:
+        """
+        Borrow an open handle for `path`.
+
+        Parameters
+        ----------
+        path: path-like
+            Local h5 file.
+        recorder: optional
+            An `instrument.phase` recorder to count opens and pool hits and
+            misses against. If not given, they are recorded under the
+            ``h5pool`` source.
+
+        """
+        if recorder is None:
+            with instrument.phase("h5pool", "acquire", path) as recorder:
+                entry = self._checkout(path, recorder)
+        else:
+            entry = self._checkout(path, recorder)
+        try:
+            yield entry.file
+        finally:
+            with self._lock:
+                entry.refs -= 1
+                self._evict()
+
+    def clear(self) -> None:
+        """Close all idle handles."""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.refs == 0:
+                    del self._entries[key]
+                    entry.file.close()
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                handles=len(self._entries),
+                in_use=sum(1 for e in self._entries.values() if e.refs),
+                max_handles=self.max_handles,
+                rdcc_nbytes=self.rdcc_nbytes,
+                rdcc_nslots=self.rdcc_nslots,
+                rdcc_w0=self.rdcc_w0,
+            )
+
+    def _checkout(self, path: PathLike, recorder: Any) -> _Entry:
+        import h5py
+
+        path = os.path.abspath(os.fspath(path))
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            self._check_pid()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.refs += 1
+                recorder.hit()
+                return entry
+
+        # Open outside the lock; it's the slow part.
+        recorder.miss()
+        recorder.add_open()
+        file = h5py.File(
+            path,
+            "r",
+            rdcc_nbytes=self.rdcc_nbytes,
+            rdcc_nslots=self.rdcc_nslots,
+            rdcc_w0=self.rdcc_w0,
+        )
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(file)
+            else:
+                # Another thread opened it first.
+                file.close()
+                self._entries.move_to_end(key)
+            entry.refs += 1
+            self._drop_stale(path, key)
+        return entry
+
+    def _check_pid(self) -> None:
+        # HDF5 handles can't be shared with a forked child. Forget (but don't
+        # close) the parent's handles.
+        pid = os.getpid()
+        if pid != self._pid:
+            self._entries = OrderedDict()
+            self._pid = pid
+
+    def _drop_stale(self, path: str, current: _Key) -> None:
+        # Close idle handles to older versions of a rewritten file.
+        for key, entry in list(self._entries.items()):
+            if key[0] == path and key != current and entry.refs == 0:
+                del self._entries[key]
+                entry.file.close()
+
+    def _evict(self) -> None:
+        excess = len(self._entries) - self.max_handles
+        if excess <= 0:
+            return
+        for key, entry in list(self._entries.items()):
+            if excess <= 0:
+                break
+            if entry.refs == 0:
+                del self._entries[key]
+                entry.file.close()
+                excess -= 1
+
+
+_pool = H5HandlePool()
+
+
+def get_pool() -> H5HandlePool:
+    """Return the process-wide handle pool."""
+    return _pool
+
+
+def configure_pool(**kwargs: Any) -> H5HandlePool:
+    """
+    Configure the process-wide handle pool. See `H5HandlePool` for settings.
+    """
+    _pool.configure(**kwargs)
+    return _pool
@@ -0,0 +1,350 @@
+"""
+I/O instrumentation shared by all drivers.
+
+Drivers wrap their expensive steps (file discovery, XML parsing, h5 opening,
+data reads) in `phase` blocks. When instrumentation is disabled -- the
+default -- `phase` hands back a shared no-op recorder, so the only cost is a
+function call and a flag check.
+
+Enable it programmatically::
+
+    from intake_thorlabs import instrument
+    instrument.enable_stats(log=True)
+    ...
+    print(instrument.get_stats())
+
+or without touching code by setting the environment variable
+``INTAKE_THORLABS_STATS`` to ``1`` (stats only) or ``log`` (stats and
+structured log events) before the package is imported.
+
+"""
+import logging
+import os
+import threading
+import time
+from typing import (
+    Any,
+    Dict,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+__all__ = [
+    "IOStats",
+    "PhaseStats",
+    "disable_stats",
+    "enable_stats",
+    "get_stats",
+    "phase",
+    "reset_stats",
+    "stats_enabled",
+]
+
+logger = logging.getLogger("intake_thorlabs.io")
+
+
+class PhaseStats:
+    """
+    Counters for one (source, phase) pair.
+    """
+
+    __slots__ = (
+        "calls",
+        "wall_time",
+        "bytes_read",
+        "opens",
+        "cache_hits",
+        "cache_misses",
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_time = 0.0
+        self.bytes_read = 0
+        self.opens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        items = ", ".join(f"{k}={v!r}" for k, v in self.to_dict().items())
+        return f"PhaseStats({items})"
+
+
+class IOStats:
+    """
+    Thread-safe accumulator of `PhaseStats`, keyed on (source, phase).
+
+    Sources are identified by their driver name (e.g. ``"thorsync"``) so that
+    the stats of many instances of one driver aggregate together.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[Tuple[str, str], PhaseStats] = {}
+
+    def add(
+        self,
+        source: str,
+        phase: str,
+        *,
+        calls: int = 0,
+        wall_time: float = 0.0,
+        bytes_read: int = 0,
+        opens: int = 0,
+        cache_hits: int = 0,
+        cache_misses: int = 0,
+    ) -> None:
+        with self._lock:
+            st = self._data.get((source, phase))
+            if st is None:
+                st = self._data[(source, phase)] = PhaseStats()
+            st.calls += calls
+            st.wall_time += wall_time
+            st.bytes_read += bytes_read
+            st.opens += opens
+            st.cache_hits += cache_hits
+            st.cache_misses += cache_misses
+
+    def get(self, source: str, phase: str) -> PhaseStats:
+        """Return a copy of the counters for one (source, phase) pair."""
+        out = PhaseStats()
+        with self._lock:
+            st = self._data.get((source, phase))
+            if st is not None:
+                for name in PhaseStats.__slots__:
+                    setattr(out, name, getattr(st, name))
+        return out
+
+    def by_phase(self) -> Dict[str, PhaseStats]:
+        """Counters summed over sources."""
+        return self._group(1)
+
+    def by_source(self) -> Dict[str, PhaseStats]:
+        """Counters summed over phases."""
+        return self._group(0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def to_dict(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """Nested ``{source: {phase: counters}}`` mapping."""
+        out = {}
+        with self._lock:
+            for (source, phase), st in sorted(self._data.items()):
+                out.setdefault(source, {})[phase] = st.to_dict()
+        return out
+
+    def _group(self, index: int) -> Dict[str, PhaseStats]:
+        out = {}
+        with self._lock:
+            for key, st in self._data.items():
+                tot = out.setdefault(key[index], PhaseStats())
+                for name in PhaseStats.__slots__:
+                    setattr(tot, name, getattr(tot, name) + getattr(st, name))
+        return out
+
+    def __repr__(self) -> str:
+        lines = [
+            f"{'source':<20}{'phase':<14}{'calls':>7}{'time (ms)':>12}"
+            f"{'bytes':>14}{'opens':>7}{'hits':>7}{'misses':>7}"
+        ]
+        for source, phases in self.to_dict().items():
+            for phase, st in phases.items():
+                lines.append(
+                    f"{source:<20}{phase:<14}{st['calls']:>7}"
+                    f"{st['wall_time'] * 1000:>12.2f}{st['bytes_read']:>14}"
+                    f"{st['opens']:>7}{st['cache_hits']:>7}"
+                    f"{st['cache_misses']:>7}"
+                )
+        return "\n".join(lines)
+
+
+class _Phase:
+    """
+    Active recorder for one phase. Counters are flushed into the global
+    `IOStats` (and optionally logged) on exit.
+    """
+
+    __slots__ = (
+        "source",
+        "phase",
+        "path",
+        "bytes_read",
+        "opens",
+        "cache_hits",
+        "cache_misses",
+        "_t0",
+    )
+
+    def __init__(self, source: str, phase: str, path: Optional[str]):
+        self.source = source
+        self.phase = phase
+        self.path = path
+        self.bytes_read = 0
+        self.opens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._t0 = 0.0
+
+    def add_bytes(self, n: int) -> None:
+        self.bytes_read += int(n)
+
+    def add_open(self, n: int = 1) -> None:
+        self.opens += n
+
+    def hit(self, n: int = 1) -> None:
+        self.cache_hits += n
+
+    def miss(self, n: int = 1) -> None:
+        self.cache_misses += n
+
+    def __enter__(self) -> "_Phase":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        elapsed = time.perf_counter() - self._t0
+        _stats.add(
+            self.source,
+            self.phase,
+            calls=1,
+            wall_time=elapsed,
+            bytes_read=self.bytes_read,
+            opens=self.opens,
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
+        )
+        if _log_level is not None and logger.isEnabledFor(_log_level):
+            event = {
+                "source": self.source,
+                "phase": self.phase,
+                "path": self.path,
+                "wall_time": elapsed,
+                "bytes_read": self.bytes_read,
+                "opens": self.opens,
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "error": exc_type.__name__ if exc_type else None,
+            }
+            logger.log(
+                _log_level,
+                "%s %s %.3f ms",
+                self.source,
+                self.phase,
+                elapsed * 1000,
+                extra={"intake_thorlabs": event},
+            )
+
+
+class _NullPhase:
+    """
+    Shared no-op recorder handed out while instrumentation is disabled.
+    """
+
+    __slots__ = ()
+
+    def add_bytes(self, n: int) -> None:
+        pass
+
+    def add_open(self, n: int = 1) -> None:
+        pass
+
+    def hit(self, n: int = 1) -> None:
+        pass
+
+    def miss(self, n: int = 1) -> None:
+        pass
+
+    def __enter__(self) -> "_NullPhase":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+_stats = IOStats()
+_enabled = False
+_log_level: Optional[int] = None
+
+
+def phase(source: Any, name: str, path: Optional[Any] = None):
+    """
+    Return a context manager recording one instrumented phase.
+
+    Parameters
+    ----------
+    source: DataSource or str
+        The source doing the work, or a driver name.
+    name: str
+        Phase name, e.g. ``"find_file"``, ``"parse_xml"``, ``"open_h5"``
+        or ``"read"``.
+    path: path-like, optional
+        File being worked on. Only used in log events.
+
+    Returns
+    -------
+    recorder:
+        Object with ``add_bytes``, ``add_open``, ``hit`` and ``miss``
+        methods. A shared no-op object when instrumentation is disabled.
+
+    """
+    if not _enabled:
+        return _NULL_PHASE
+    label = source if isinstance(source, str) else getattr(source, "name", None)
+    label = label or type(source).__name__
+    return _Phase(label, name, None if path is None else os.fspath(path))
+
+
+def enable_stats(log: bool = False, level: int = logging.DEBUG) -> IOStats:
+    """
+    Turn instrumentation on and return the global `IOStats` object.
+
+    Parameters
+    ----------
+    log: bool, optional
+        If `True`, also emit one structured log record per phase on the
+        ``intake_thorlabs.io`` logger. The event dict is attached to the
+        record as the ``intake_thorlabs`` attribute.
+    level: int, optional
+        Level of the emitted log records.
+
+    """
+    global _enabled, _log_level
+    _enabled = True
+    _log_level = level if log else None
+    return _stats
+
+
+def disable_stats() -> None:
+    """Turn instrumentation off. Collected stats are kept."""
+    global _enabled, _log_level
+    _enabled = False
+    _log_level = None
+
+
+def stats_enabled() -> bool:
+    return _enabled
+
+
+def get_stats() -> IOStats:
+    return _stats
+
+
+def reset_stats() -> None:
+    _stats.reset()
+
+
+def _configure_from_env(env: Mapping[str, str] = os.environ) -> None:
+    val = env.get("INTAKE_THORLABS_STATS", "").strip().lower()
+    if val in {"", "0", "false", "no", "off"}:
+        return
+    enable_stats(log=(val == "log"))
+
+
+_configure_from_env()
@@ -0,0 +1,306 @@
+"""
+Session integrity checks.
+
+`check_session` validates an experiment folder in one streaming pass over the
+sync data and a stat of the raw image file(s):
+
+- ``partial_frame``: the raw file doesn't hold a whole number of frames.
+- ``length_mismatch``: GCtr and the AI/DI datasets differ in length.
+- ``gctr_gap``: the GCtr clock goes backwards, stalls or skips (advances by
+  more than 1.5 times its median step) between two samples.
+- ``frame_count``: the number of frame pulses on the frame line doesn't match
+  the number of frames on disk.
+
+Results are cached on disk per file version (path, size and mtime of every
+file checked), so re-running over unchanged sessions is nearly free.
+
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Union,
+)
+
+from . import instrument
+from .common import PathLike
+from .experiment import ThorExperimentSource
+
+__all__ = [
+    "IntegrityReport",
+    "check_session",
+    "check_sessions",
+]
+
+_CACHE_VERSION = 3
+# steps above this multiple of the typical GCtr step are gaps
+_MAX_STEP_RATIO = 1.5
+
+
+class IntegrityReport:
+    """
+    Result of `check_session`.
+
+    Attributes
+    ----------
+    path: str
+        Session folder.
+    files: dict
+        Resolved metadata, image and sync paths (`None` if absent).
+    summary: dict
+        Measured quantities: frame counts, sample counts, pulse counts, etc.
+    issues: list of dict
+        One dict per problem found, with at least 'check' and 'message' keys.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        files: Mapping[str, Optional[str]],
+        summary: Optional[Dict[str, Any]] = None,
+        issues: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self.path = path
+        self.files = dict(files)
+        self.summary = summary or {}
+        self.issues = issues or []
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+    def add(self, check: str, message: str, **details: Any) -> None:
+        self.issues.append(dict(check=check, message=message, **details))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(
+            path=self.path,
+            files=self.files,
+            summary=self.summary,
+            issues=self.issues,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "IntegrityReport":
+        return cls(data["path"], data["files"], data["summary"], data["issues"])
+
+    def __repr__(self) -> str:
+        lines = [f"IntegrityReport({self.path!r}, ok={self.ok})"]
+        for issue in self.issues:
+            lines.append(f"  {issue['check']}: {issue['message']}")
+        return "\n".join(lines)
+
+
+def check_session(
+    path: PathLike,
+    *,
+    frame_line: str = "FrameOut",
+    chunk_size: int = 2 ** 20,
+    cache_dir: Union[PathLike, bool, None] = None,
+) -> IntegrityReport:
+    """
+    Check one experiment folder.
+
+    Parameters
+    ----------
+    path: path-like
+        Experiment folder (see `ThorExperimentSource`).
+    frame_line: str, optional
+        Digital line carrying one pulse per acquired frame.
+    chunk_size: int, optional
+        Number of sync samples processed per step of the streaming pass.
+    cache_dir: path-like or bool, optional
+        Directory for cached results. Defaults to
+        ``$XDG_CACHE_HOME/intake_thorlabs/integrity``. `False` disables
+        caching.
+
+    Returns
+    -------
+    report: IntegrityReport
+
+    """
+    exp = ThorExperimentSource(path)
+    files = exp.files
+    versions = [_file_version(p) for paths in exp.paths.values()
+                for p in paths]
+    params = dict(frame_line=frame_line, version=_CACHE_VERSION)
+    cache_path = _cache_path(cache_dir, versions, params)
+
+    with instrument.phase("integrity", "cache", cache_path) as ph:
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path) as f:
+                    report = IntegrityReport.from_dict(json.load(f))
+                ph.hit()
+                return report
+            except (OSError, ValueError, KeyError):
+                pass
+        ph.miss()
+
+    report = IntegrityReport(exp.path, files)
+    try:
+        with instrument.phase("integrity", "check", exp.path):
+            md = exp.to_dict()
+            if files["image"]:
+                _check_image(report, exp, md)
+            if files["sync"]:
+                _check_sync(report, exp, frame_line, chunk_size, md)
+    finally:
+        exp.close()
+
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(report.to_dict(), f)
+            os.replace(tmp, cache_path)
+        except OSError:
+            pass
+    return report
+
+
+def check_sessions(
+    paths: Iterable[PathLike],
+    *,
+    n_workers: int = 8,
+    **kwargs: Any,
+) -> List[IntegrityReport]:
+    """
+    Check many sessions concurrently. Arguments are passed to
+    `check_session`. Reports are returned in the order of `paths`.
+    """
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(lambda p: check_session(p, **kwargs), paths))
+
+
+def _check_image(
+    report: IntegrityReport,
+    exp: ThorExperimentSource,
+    md: Mapping[str, Any],
+) -> None:
+    import numpy as np
+
+    frame = md["frame"]
+    framesize = int(np.prod(frame["shape"])) * np.dtype(frame["dtype"]).itemsize
+    n_frames = 0
+    for path in exp.paths["image"]:
+        filesize = os.stat(path).st_size
+        count, remainder = divmod(filesize, framesize)
+        n_frames += count
+        if remainder:
+            report.add(
+                "partial_frame",
+                f"raw file {os.path.basename(path)} ends with a partial "
+                f"frame of {remainder} bytes ({framesize} bytes per frame)",
+                trailing_bytes=remainder,
+            )
+    report.summary["n_frames"] = n_frames
+
+
+def _check_sync(
+    report: IntegrityReport,
+    exp: ThorExperimentSource,
+    frame_line: str,
+    chunk_size: int,
+    md: Mapping[str, Any],
+) -> None:
+    import numpy as np
+
+    from .runs import clock_step
+
+    sync = exp.sync
+    views = sync.to_memmap()
+    lengths = {name: len(arr) for name, arr in views.items()}
+    report.summary["lengths"] = lengths
+    n_samples = lengths["GCtr"]
+    report.summary["n_samples"] = n_samples
+    bad = {k: v for k, v in lengths.items() if v != n_samples}
+    if bad:
+        report.add(
+            "length_mismatch",
+            f"datasets differ in length from GCtr ({n_samples}): {bad}",
+            lengths=bad,
+        )
+
+    # One streaming pass: clock gaps and frame pulses, chunk by chunk with
+    # one sample of overlap.
+    clock = views["GCtr"]
+    line = views.get(frame_line)
+    n = min([n_samples] + ([len(line)] if line is not None else []))
+    # GCtr ticks at the clock rate, a non-integer number of ticks per
+    # sample, so a clean clock alternates between neighbouring steps. Flag
+    # steps that go backwards or skip at least half a sample.
+    step = clock_step(clock[:n])
+    max_step = step * _MAX_STEP_RATIO
+    report.summary["gctr_step"] = step
+    n_gaps = 0
+    first_gap = None
+    n_pulses = 0
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size + 1, n)
+        steps = np.diff(clock[start:stop].astype(np.int64))
+        gaps = np.flatnonzero((steps <= 0) | (steps > max_step))
+        if len(gaps):
+            n_gaps += len(gaps)
+            if first_gap is None:
+                first_gap = start + int(gaps[0])
+        if line is not None:
+            high = line[start:stop] > 0
+            n_pulses += int(np.count_nonzero(high[1:] & ~high[:-1]))
+            if start == 0 and len(high) and high[0]:
+                n_pulses += 1
+    report.summary["gctr_gaps"] = n_gaps
+    if n_gaps:
+        report.add(
+            "gctr_gap",
+            f"GCtr does not advance by ~{step} ticks at {n_gaps} sample(s), "
+            f"first after sample {first_gap}",
+            count=n_gaps,
+            first=first_gap,
+        )
+
+    if line is None:
+        return
+    report.summary["frame_pulses"] = n_pulses
+    n_frames = report.summary.get("n_frames")
+    if n_frames is None:
+        return
+    averaging = md.get("frame", {}).get("averaging", 1) or 1
+    expected = {n_frames, n_frames * averaging}
+    if n_pulses not in expected:
+        report.add(
+            "frame_count",
+            f"{n_pulses} pulses on {frame_line} but {n_frames} frames on disk",
+            pulses=n_pulses,
+            frames=n_frames,
+        )
+
+
+def _file_version(path: str) -> List[Any]:
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+def _cache_path(
+    cache_dir: Union[PathLike, bool, None],
+    versions: List[List[Any]],
+    params: Mapping[str, Any],
+) -> Optional[str]:
+    if cache_dir is False:
+        return None
+    if cache_dir is None or cache_dir is True:
+        root = os.environ.get("XDG_CACHE_HOME") or \
+               os.path.join(os.path.expanduser("~"), ".cache")
+        cache_dir = os.path.join(root, "intake_thorlabs", "integrity")
+    key = json.dumps([versions, params], sort_keys=True)
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(os.fspath(cache_dir), f"{digest}.json")
@@ -0,0 +1,263 @@
+"""
+Rigid motion registration by FFT phase correlation.
+
+Frames are registered against a reference image (the mean of a sample of
+frames), chunk by chunk across a thread pool, with one batched FFT per chunk.
+Only the per-frame shifts are kept: they are cached in a small sidecar file
+next to the raw data and applied lazily when frames are read, so corrected
+data is never written to disk.
+
+"""
+import json
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Mapping,
+    Optional,
+)
+
+from . import instrument
+from .common import PathLike
+
+if TYPE_CHECKING:
+    import numpy as np
+
+__all__ = [
+    "apply_shifts",
+    "load_or_compute_shifts",
+    "reference_image",
+    "register_frames",
+]
+
+Transform = Callable[..., "np.ndarray"]
+
+
+def reference_image(
+    frames: "np.ndarray",
+    n_frames: int = 200,
+    transform: Optional[Transform] = None,
+) -> "np.ndarray":
+    """
+    Return the mean of up to `n_frames` evenly spaced frames as float32.
+
+    If `transform` is given, it is applied to each sampled frame first (it is
+    called with a one-frame block and that frame's index).
+    """
+    import numpy as np
+
+    n_total = len(frames)
+    n = max(min(n_frames, n_total), 1)
+    indices = np.unique(np.linspace(0, n_total - 1, n).astype(int))
+    ref = np.zeros(frames.shape[1:], dtype=np.float64)
+    for i in indices:
+        frame = frames[i:i + 1]
+        if transform is not None:
+            frame = transform(frame, start=int(i))
+        ref += frame[0]
+    ref /= len(indices)
+    return ref.astype(np.float32)
+
+
+def register_frames(
+    frames: "np.ndarray",
+    reference: "np.ndarray",
+    *,
+    chunk_size: int = 128,
+    n_workers: Optional[int] = None,
+    max_shift: Optional[int] = None,
+    transform: Optional[Transform] = None,
+) -> "np.ndarray":
+    """
+    Compute the rigid shift that aligns each frame to `reference`.
+
+    Parameters
+    ----------
+    frames: array-like
+        (t, y, x) stack, e.g. a memmap. Read one chunk at a time.
+    reference: ndarray
+        (y, x) reference image.
+    chunk_size: int, optional
+        Frames per batched FFT.
+    n_workers: int, optional
+        Number of threads. Defaults to the number of CPUs.
+    max_shift: int, optional
+        Largest shift (in pixels, per axis) considered.
+    transform: callable, optional
+        Applied to each chunk before registration; called with the block and
+        the index of its first frame.
+
+    Returns
+    -------
+    shifts: ndarray
+        (t, 2) float32 array of (dy, dx) shifts that move each frame onto the
+        reference. Sub-pixel estimates from a parabolic fit around the peak.
+
+    """
+    import numpy as np
+
+    n_total = len(frames)
+    shifts = np.zeros((n_total, 2), dtype=np.float32)
+    ref_fft = np.conj(np.fft.fft2(reference.astype(np.float32)))
+    shape = reference.shape
+    if max_shift is None:
+        max_shift = min(shape) // 4
+    mask = _shift_mask(shape, max_shift)
+
+    def work(start: int) -> None:
+        stop = min(start + chunk_size, n_total)
+        block = np.asarray(frames[start:stop])
+        if transform is not None:
+            block = transform(block, start=start)
+        spec = np.fft.fft2(block.astype(np.float32, copy=False))
+        spec *= ref_fft
+        spec /= np.abs(spec) + 1e-12
+        xcorr = np.fft.ifft2(spec).real
+        xcorr[:, ~mask] = -np.inf
+        shifts[start:stop] = -_peaks(xcorr)
+
+    n_workers = n_workers or os.cpu_count() or 1
+    with instrument.phase("registration", "register") as ph:
+        starts = range(0, n_total, chunk_size)
+        if n_workers == 1:
+            for start in starts:
+                work(start)
+        else:
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                list(pool.map(work, starts))
+        ph.add_bytes(n_total * int(np.prod(shape)) * frames.dtype.itemsize)
+    return shifts
+
+
+def apply_shifts(block: "np.ndarray", shifts: "np.ndarray") -> "np.ndarray":
+    """
+    Shift each frame of `block` in place by its (dy, dx), rounded to whole
+    pixels. Pixels shifted in from outside the frame are set to 0.
+    """
+    import numpy as np
+
+    height, width = block.shape[-2:]
+    for frame, (dy, dx) in zip(block, np.rint(shifts).astype(int)):
+        if not dy and not dx:
+            continue
+        if abs(dy) >= height or abs(dx) >= width:
+            frame[...] = 0
+            continue
+        dst_y, src_y = _span(dy, height)
+        dst_x, src_x = _span(dx, width)
+        # numpy buffers overlapping copies, so in-place is safe.
+        frame[dst_y, dst_x] = frame[src_y, src_x]
+        if dy > 0:
+            frame[:dy] = 0
+        elif dy < 0:
+            frame[dy:] = 0
+        if dx > 0:
+            frame[:, :dx] = 0
+        elif dx < 0:
+            frame[:, dx:] = 0
+    return block
+
+
+def load_or_compute_shifts(
+    path: PathLike,
+    frames: "np.ndarray",
+    *,
+    sidecar: Optional[PathLike] = None,
+    reference_frames: int = 200,
+    transform: Optional[Transform] = None,
+    **kwargs: Any,
+) -> "np.ndarray":
+    """
+    Return cached shifts for the raw file at `path`, computing and caching
+    them if the sidecar is missing or stale.
+
+    The sidecar (default ``<path>.shifts.npz``) records the raw file's size
+    and mtime, the registration parameters and `transform` (by its repr,
+    which for `corrections.Corrections` lists its parameters), since the
+    shifts are estimated on transformed frames; a mismatch triggers
+    recomputation. Extra arguments are passed to `register_frames`.
+    """
+    import numpy as np
+
+    path = os.fspath(path)
+    sidecar = os.fspath(sidecar) if sidecar else path + ".shifts.npz"
+    st = os.stat(path)
+    params = dict(kwargs, reference_frames=reference_frames)
+    params.pop("n_workers", None)
+    key = json.dumps(
+        dict(size=st.st_size, mtime_ns=st.st_mtime_ns,
+             shape=list(frames.shape), params=params,
+             transform=None if transform is None else repr(transform)),
+        sort_keys=True,
+    )
+
+    with instrument.phase("registration", "sidecar", sidecar) as ph:
+        try:
+            with np.load(sidecar) as npz:
+                if str(npz["key"]) == key:
+                    ph.hit()
+                    ph.add_open()
+                    return npz["shifts"]
+        except (OSError, KeyError, ValueError):
+            pass
+        ph.miss()
+
+    ref = reference_image(frames, reference_frames, transform=transform)
+    shifts = register_frames(frames, ref, transform=transform, **kwargs)
+
+    tmp = f"{sidecar}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            np.savez(f, shifts=shifts, reference=ref, key=np.array(key))
+        os.replace(tmp, sidecar)
+    except OSError as exc:
+        warnings.warn(f"could not write registration sidecar {sidecar}: {exc}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return shifts
+
+
+def _peaks(xcorr: "np.ndarray") -> "np.ndarray":
+    """(n, 2) signed peak locations with parabolic sub-pixel refinement."""
+    import numpy as np
+
+    n, height, width = xcorr.shape
+    flat = xcorr.reshape(n, -1).argmax(axis=1)
+    iy, ix = np.unravel_index(flat, (height, width))
+    rows = np.arange(n)
+
+    def refine(c0, cm, cp):
+        denom = cm - 2 * c0 + cp
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = np.where(np.isfinite(denom) & (denom < 0),
+                             0.5 * (cm - cp) / denom, 0.0)
+        return np.clip(delta, -0.5, 0.5)
+
+    c0 = xcorr[rows, iy, ix]
+    dy = refine(c0, xcorr[rows, (iy - 1) % height, ix],
+                xcorr[rows, (iy + 1) % height, ix])
+    dx = refine(c0, xcorr[rows, iy, (ix - 1) % width],
+                xcorr[rows, iy, (ix + 1) % width])
+    peak_y = np.where(iy > height // 2, iy - height, iy) + dy
+    peak_x = np.where(ix > width // 2, ix - width, ix) + dx
+    return np.stack([peak_y, peak_x], axis=1)
+
+
+def _shift_mask(shape, max_shift: int) -> "np.ndarray":
+    import numpy as np
+
+    ys = np.fft.fftfreq(shape[0], 1 / shape[0])
+    xs = np.fft.fftfreq(shape[1], 1 / shape[1])
+    return (np.abs(ys)[:, None] <= max_shift) & (np.abs(xs)[None, :] <= max_shift)
+
+
+def _span(shift: int, size: int):
+    """Destination and source slices for a shift along one axis."""
+    if shift > 0:
+        return slice(shift, size), slice(0, size - shift)
+    if shift < 0:
+        return slice(0, size + shift), slice(-shift, size)
+    return slice(None), slice(None)
@@ -0,0 +1,321 @@
+"""
+Run-length encoded ThorSync digital lines.
+
+Digital lines hold one value for long stretches, so storing them as runs --
+the sample index, clock tick and value at which each run starts -- takes
+memory proportional to the number of transitions rather than the number of
+samples. `encode_line` builds the runs in one streaming, vectorized pass over
+a (memory-mapped) dataset, and `RunLengthLine` answers value, edge, duty
+cycle and interval queries directly on the runs. The dense array is only
+rebuilt by `decode`.
+
+Times are in seconds, computed as ``GCtr / clock_rate`` exactly like the
+'time' column of `ThorSyncSource.read`.
+
+"""
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Optional,
+    Union,
+)
+
+from . import instrument
+
+if TYPE_CHECKING:
+    import numpy as np
+    from numpy.typing import ArrayLike, DTypeLike
+
+__all__ = [
+    "RunLengthLine",
+    "clock_step",
+    "encode_line",
+    "intersect_intervals",
+]
+
+
+class RunLengthLine:
+    """
+    A digital line stored as runs of constant value.
+
+    Parameters
+    ----------
+    starts: ndarray
+        Sample index at which each run starts; the first is 0.
+    ticks: ndarray
+        GCtr tick at which each run starts.
+    values: ndarray
+        Value of each run. Consecutive values differ.
+    length: int
+        Number of samples.
+    end_tick: int
+        GCtr tick just past the last sample, i.e. one sample step after it.
+    clock_rate: float
+        GCtr ticks per second.
+
+    """
+
+    def __init__(
+        self,
+        starts: "np.ndarray",
+        ticks: "np.ndarray",
+        values: "np.ndarray",
+        length: int,
+        end_tick: int,
+        clock_rate: float,
+    ):
+        self.starts = starts
+        self.ticks = ticks
+        self.values = values
+        self.length = int(length)
+        self.end_tick = int(end_tick)
+        self.clock_rate = clock_rate
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __repr__(self) -> str:
+        return f"RunLengthLine({self.n_runs} runs, {self.length} samples, " \
+               f"dtype={str(self.dtype)!r})"
+
+    @property
+    def dtype(self) -> "np.dtype":
+        return self.values.dtype
+
+    @property
+    def n_runs(self) -> int:
+        return len(self.values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.starts.nbytes + self.ticks.nbytes + self.values.nbytes
+
+    @property
+    def times(self) -> "np.ndarray":
+        """Start time of each run, in seconds."""
+        return self.ticks / self.clock_rate
+
+    @property
+    def stop_times(self) -> "np.ndarray":
+        """End time (exclusive) of each run, in seconds."""
+        import numpy as np
+
+        ticks = np.append(self.ticks[1:], self.end_tick)
+        return ticks / self.clock_rate
+
+    def decode(self) -> "np.ndarray":
+        """Return the line as a dense array, one value per sample."""
+        import numpy as np
+
+        counts = np.diff(np.append(self.starts, self.length))
+        return np.repeat(self.values, counts)
+
+    def __array__(self, dtype: Optional["DTypeLike"] = None) -> "np.ndarray":
+        out = self.decode()
+        return out if dtype is None else out.astype(dtype)
+
+    def value_at(self, t: "ArrayLike") -> Union[Any, "np.ndarray"]:
+        """
+        Return the value of the line at time(s) `t`. Times outside the
+        recording raise `ValueError`.
+        """
+        import numpy as np
+
+        t = np.asarray(t, dtype=np.float64)
+        if np.any(t < self.times[0]) or \
+                np.any(t >= self.end_tick / self.clock_rate):
+            raise ValueError("time outside the recording")
+        index = np.searchsorted(self.times, t, side="right") - 1
+        return self.values[index]
+
+    def edges(self, kind: str = "rising") -> "np.ndarray":
+        """
+        Return the times at which the line's value goes up ("rising"), down
+        ("falling") or changes at all ("both").
+        """
+        import numpy as np
+
+        steps = np.diff(self.values.astype(np.int64))
+        if kind == "rising":
+            mask = steps > 0
+        elif kind == "falling":
+            mask = steps < 0
+        elif kind == "both":
+            mask = steps != 0
+        else:
+            raise ValueError(f"invalid edge kind: {kind}")
+        return self.times[1:][mask]
+
+    def intervals(self, value: Optional[Any] = None) -> "np.ndarray":
+        """
+        Return the (n, 2) [start, stop) times where the line is nonzero, or
+        equal to `value` if given. Adjacent matching runs are merged.
+        """
+        if value is None:
+            mask = self.values != 0
+        else:
+            mask = self.values == value
+        return _merge(self.times, self.stop_times, mask)
+
+    def duty_cycle(
+        self,
+        start: Optional[float] = None,
+        stop: Optional[float] = None,
+    ) -> float:
+        """
+        Fraction of the time in ``[start, stop)`` (default: the whole
+        recording) for which the line is nonzero.
+        """
+        import numpy as np
+
+        lo = self.times[0] if start is None else start
+        hi = self.end_tick / self.clock_rate if stop is None else stop
+        if hi <= lo:
+            raise ValueError("empty time window")
+        high = intersect_intervals(self.intervals(), np.array([[lo, hi]]))
+        return float(np.sum(high[:, 1] - high[:, 0]) / (hi - lo))
+
+    def overlap(
+        self,
+        other: Union["RunLengthLine", "ArrayLike"],
+    ) -> "np.ndarray":
+        """
+        Return the (n, 2) intervals where this line and `other` -- another
+        line, or an (m, 2) array of [start, stop) intervals -- are both
+        nonzero.
+        """
+        if isinstance(other, RunLengthLine):
+            other = other.intervals()
+        return intersect_intervals(self.intervals(), other)
+
+
+def encode_line(
+    data: "np.ndarray",
+    clock: "np.ndarray",
+    clock_rate: float,
+    *,
+    binary: bool = False,
+    dtype: Optional["DTypeLike"] = None,
+    chunk_size: int = 2 ** 22,
+    source: Optional[Any] = None,
+) -> RunLengthLine:
+    """
+    Run-length encode a digital line in one streaming pass.
+
+    Parameters
+    ----------
+    data: array-like
+        1-d line, e.g. a memmap from `ThorSyncSource.to_memmap`. Read
+        `chunk_size` samples at a time.
+    clock: array-like
+        1-d GCtr clock of the same length.
+    clock_rate: float
+        GCtr ticks per second.
+    binary: bool, optional
+        Squash values into {0, 1}, as `ThorSyncSource` does for binary lines.
+    dtype: dtype-like, optional
+        dtype of the run values. Defaults to int8 for binary lines and the
+        data's dtype otherwise.
+    chunk_size: int, optional
+        Samples processed per step.
+    source: optional
+        Source (or name) to record instrumentation against.
+
+    Returns
+    -------
+    line: RunLengthLine
+
+    """
+    import numpy as np
+
+    n = min(len(data), len(clock))
+    if dtype is None:
+        dtype = np.int8 if binary else data.dtype
+    dtype = np.dtype(dtype)
+    starts = []
+    values = []
+    last = None
+    with instrument.phase(source if source is not None else "runs", "encode") as ph:
+        for lo in range(0, n, chunk_size):
+            chunk = np.asarray(data[lo:min(lo + chunk_size, n)])
+            ph.add_bytes(chunk.nbytes)
+            if binary:
+                chunk = np.clip(chunk, 0, 1)
+            chunk = chunk.astype(dtype, copy=False)
+            change = np.flatnonzero(chunk[1:] != chunk[:-1]) + 1
+            if last is None or chunk[0] != last:
+                change = np.concatenate([[0], change])
+            starts.append(change + lo)
+            values.append(chunk[change])
+            last = chunk[-1]
+
+    if n:
+        starts = np.concatenate(starts).astype(np.int64)
+        values = np.concatenate(values)
+        ticks = np.asarray(clock[starts]).astype(np.int64)
+        end_tick = int(clock[n - 1]) + clock_step(clock[:n])
+    else:
+        starts = np.zeros(0, dtype=np.int64)
+        values = np.zeros(0, dtype=dtype)
+        ticks = np.zeros(0, dtype=np.int64)
+        end_tick = 0
+    return RunLengthLine(starts, ticks, values, n, end_tick, clock_rate)
+
+
+def clock_step(clock: "np.ndarray", n: int = 1024) -> int:
+    """
+    Return the number of GCtr ticks per sample: the median step over the
+    first `n` samples, so a few gaps don't skew it. 1 for clocks of fewer
+    than two samples.
+    """
+    import numpy as np
+
+    head = np.asarray(clock[:n]).astype(np.int64)
+    if len(head) < 2:
+        return 1
+    return max(int(np.median(np.diff(head))), 1)
+
+
+def intersect_intervals(a: "ArrayLike", b: "ArrayLike") -> "np.ndarray":
+    """
+    Intersect two sorted, disjoint (n, 2) arrays of [start, stop) intervals.
+    """
+    import numpy as np
+
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 2)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 2)
+    if not len(a) or not len(b):
+        return np.zeros((0, 2))
+    points = np.union1d(a.ravel(), b.ravel())
+    mids = (points[:-1] + points[1:]) / 2
+    inside = _covered(a, mids) & _covered(b, mids)
+    return _merge(points[:-1], points[1:], inside)
+
+
+def _covered(intervals: "np.ndarray", t: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    index = np.searchsorted(intervals[:, 0], t, side="right") - 1
+    valid = index >= 0
+    out = np.zeros(len(t), dtype=bool)
+    out[valid] = t[valid] < intervals[index[valid], 1]
+    return out
+
+
+def _merge(
+    starts: "np.ndarray",
+    stops: "np.ndarray",
+    mask: "np.ndarray",
+) -> "np.ndarray":
+    """Merge consecutive selected [start, stop) pieces into (n, 2) intervals."""
+    import numpy as np
+
+    sel = np.flatnonzero(mask)
+    if not len(sel):
+        return np.zeros((0, 2))
+    # a new interval begins wherever the previous piece wasn't selected
+    first = np.ones(len(sel), dtype=bool)
+    first[1:] = np.diff(sel) > 1
+    last = np.ones(len(sel), dtype=bool)
+    last[:-1] = first[1:]
+    return np.stack([starts[sel[first]], stops[sel[last]]], axis=1)
@@ -4,24 +4,36 @@ To Do:
 - only handles single-channel streaming t-series. expand usages.
 
 """
-import datetime
 import os
+import warnings
 from pathlib import Path
 from typing import (
+    TYPE_CHECKING,
     ClassVar,
     List,
     Mapping,
     Optional,
+    Sequence,
     Tuple,
+    Union,
 )
-from xml.etree import ElementTree
 
-import numpy as np
 from intake.source.base import DataSource, Schema
-from numpy.typing import DTypeLike
 
+from . import instrument
 from ._version import get_version
+from .blocks import BlockReader, ConcatReader, stack_to_dask
 from .common import *
+from .concat import ConcatArray
+from .corrections import Corrections
+from .frames import FrameReader
+from .tiff import TiffStack, is_tiff
+
+if TYPE_CHECKING:
+    from xml.etree import ElementTree
+
+    import numpy as np
+    from numpy.typing import DTypeLike
 
 __all__ = [
     "ThorImageArraySource",
@@ -44,18 +56,36 @@ class ThorImageMetadataSource(DataSource):
         path: PathLike,
         metadata: Optional[Mapping] = None,
         pattern: Optional[str] = "Experiment.xml",
+        resolved: bool = False,
     ):
         super().__init__(metadata=metadata)
         self._path = os.fspath(path)  # initial path argument.
-        self.path = None  # resolved path. set once known.
+        # resolved path. set once known, or up front if `resolved`.
+        self.path = os.path.abspath(self._path) if resolved else None
         self.pattern = pattern
+        self._doc = None  # parsed document. set on first read.
 
     def read(self) -> Mapping:
+        from xml.etree import ElementTree
+
         self._load_metadata()
-        return ElementTree.parse(self._schema["path"])
+        path = self._schema["path"]
+        with instrument.phase(self, "parse_xml", path) as ph:
+            if self._doc is None:
+                ph.miss()
+                self._doc = ElementTree.parse(path)
+                ph.add_open()
+                if instrument.stats_enabled():
+                    # skip the stat when nothing is recorded
+                    ph.add_bytes(os.stat(path).st_size)
+            else:
+                ph.hit()
+        return self._doc
 
     def to_dict(self) -> Mapping:
 
+        import datetime
+
         doc = self.read()
 
         # Basic info
@@ -89,6 +119,26 @@ class ThorImageMetadataSource(DataSource):
 
         return md
 
+    def get_schema(self) -> Schema:
+        self._load_metadata()
+        return self._schema
+
+    async def to_dict_async(self) -> Mapping:
+        """`to_dict`, run on the shared "io" executor (see `aio`)."""
+        from .aio import get_executor
+
+        return await get_executor("io").run(self.to_dict)
+
+    async def get_schema_async(self) -> Schema:
+        """`get_schema`, run on the shared "io" executor (see `aio`)."""
+        from .aio import get_executor
+
+        return await get_executor("io").run(self.get_schema)
+
+    def _close(self) -> None:
+        self._schema = None
+        self._doc = None
+
     def _get_partition(self, i):
         """Subclasses should return a container object for this partition
         This function will never be called with an out-of-range value for i.
@@ -98,14 +148,15 @@ class ThorImageMetadataSource(DataSource):
     def _get_schema(self) -> Schema:
 
         if self.path is None:
-            if os.path.isdir(self._path):
-                if not self.pattern:
-                    raise FileNotFoundError(self._path)
-                self.path = find_file(
-                    self.pattern, root_dir=self._path, absolute=True,
-                )
-            else:
-                self.path = find_file(self._path)
+            with instrument.phase(self, "find_file", self._path):
+                if os.path.isdir(self._path):
+                    if not self.pattern:
+                        raise FileNotFoundError(self._path)
+                    self.path = find_file(
+                        self.pattern, root_dir=self._path, absolute=True,
+                    )
+                else:
+                    self.path = find_file(self._path)
         schema = Schema(
             datashape=None,
             dtype=object,
@@ -116,7 +167,9 @@ class ThorImageMetadataSource(DataSource):
         )
         return schema
 
-    def _parse_camera(self, doc: ElementTree) -> Mapping:
+    def _parse_camera(self, doc: "ElementTree") -> Mapping:
+
+        import numpy as np
 
         # Handle frame capture info
         node = doc.find('Camera').attrib
@@ -147,9 +200,11 @@ class ThorImageMetadataSource(DataSource):
 
     def _parse_multiphoton(
         self,
-        doc: ElementTree,
+        doc: "ElementTree",
     ) -> Tuple[Mapping, List[Mapping], List[Mapping]]:
 
+        import numpy as np
+
         # Handle frame shape, FOV, and pixel size.
         node = doc.find('LSM').attrib
         name = node["name"]
@@ -195,7 +250,12 @@ class ThorImageArraySource(DataSource):
     Parameters
     ----------
     path: path-like
-        Location of raw image file.
+        Location of raw image file, or of a TIFF / OME-TIFF stack. TIFF
+        stacks take their shape and dtype from the file; uncompressed ones
+        are memory-mapped like raw files, compressed ones are decoded page by
+        page in parallel. A directory is searched with `pattern`; if
+        several files match (a stack split by ThorImage), or `path` is a
+        list of files, they are concatenated along time without copying.
     metadata_path: path-like, optional
         Location of xml metadata file. If not absolute, will look in same
         directory as the raw image file.
@@ -206,6 +266,27 @@ class ThorImageArraySource(DataSource):
     chunks: int, optional
         Size of chunks within a file along biggest dimension - need not
         be an exact factor of the length of that dimension.
+    pattern: str, optional
+        Glob used to find the image file when `path` is a directory, e.g.
+        "ChanA*.tif" for TIFF stacks.
+    frame_cache: int, optional
+        Size in bytes of the LRU frame cache used by `get_frame` and
+        `get_frames`.
+    readahead: int, optional
+        Maximum number of frames `get_frame` prefetches in the direction of
+        playback. 0 disables read-ahead.
+    corrections: mapping, optional
+        Read-time corrections applied by `to_dask`, `read` and `get_frame`
+        in one fused pass per chunk. See `corrections.Corrections` for the
+        keys. `to_memmap` always returns the raw data (for compressed TIFF
+        stacks, a `tiff.TiffStack` that decodes pages on indexing).
+    metadata_source: ThorImageMetadataSource, optional
+        Source to read frame info from when `shape` isn't given. Defaults to
+        the Experiment.xml next to the image file. Lets a composite source
+        share one parsed document.
+    resolved: bool, optional
+        If `True`, `path` is the file (or list of files) to read, already
+        resolved, and no search is made.
     """
 
     name: ClassVar[str] = "thorimagearray"
@@ -215,26 +296,45 @@ class ThorImageArraySource(DataSource):
 
     def __init__(
         self,
-        path: PathLike,
+        path: Union[PathLike, Sequence[PathLike]],
         shape: Optional[Tuple[int, ...]] = None,
-        dtype: DTypeLike = np.dtype("<H"),
+        dtype: "DTypeLike" = "<H",
         chunks: Optional[int] = None,
         metadata: Optional[Mapping] = None,
         pattern: str = "Image*.raw",
+        frame_cache: int = 256 * 2 ** 20,
+        readahead: int = 64,
+        corrections: Optional[Mapping] = None,
+        metadata_source: Optional[ThorImageMetadataSource] = None,
+        resolved: bool = False,
     ):
         super().__init__(metadata=metadata)
 
         self._path = path
-        self.path = None
+        self.path = None  # first (or only) file. set once known.
+        self.paths = None  # all files, in order
+        if resolved:
+            paths = path if isinstance(path, (list, tuple)) else [path]
+            self.paths = [os.path.abspath(os.fspath(p)) for p in paths]
+            self.path = self.paths[0]
         self.shape = shape
         self.dtype = dtype
         self.npartitions = None
         self.chunks = None
         self._chunks_arg = -1 if not chunks else chunks
         self.pattern = pattern
+        self.frame_cache = frame_cache
+        self.readahead = readahead
+        self.corrections = corrections
 
         self._memmap = None
+        self._reader = None  # `BlockReader` or `ConcatReader` for the graph
+        self._tiffs = None  # `TiffStack`s for TIFF input
         self._arr = None
+        self._frames = None
+        self._corrections = None  # resolved `Corrections` pipeline
+
+        self._metadata_source = metadata_source
 
     def get_schema(self) -> Schema:
         self._load_metadata()
@@ -243,25 +343,82 @@ class ThorImageArraySource(DataSource):
     def open(self):
         self._load_metadata()
 
+    async def get_schema_async(self) -> Schema:
+        """`get_schema`, run on the shared "io" executor (see `aio`)."""
+        from .aio import get_executor
+
+        return await get_executor("io").run(self.get_schema)
+
     def to_dask(self):
         self._load_metadata()
         return self._arr
 
-    def to_memmap(self) -> np.ndarray:
+    def to_memmap(self) -> "np.ndarray":
         self._load_metadata()
         return self._memmap
 
-    def read(self) -> np.ndarray:
+    def get_frame(self, i: int) -> "np.ndarray":
+        """
+        Return frame `i` as a read-only array, without building a dask
+        graph. Frames are served from an LRU cache and prefetched ahead of
+        sequential access.
+        """
+        return self._frame_reader().get_frame(i)
+
+    def get_frames(self, key: Union[slice, Sequence[int]]) -> "np.ndarray":
+        """
+        Return the frames selected by a slice or a sequence of indices as a
+        new array, using the same cache as `get_frame`.
+        """
+        return self._frame_reader().get_frames(key)
+
+    @property
+    def shifts(self) -> Optional["np.ndarray"]:
+        """
+        Per-frame (dy, dx) registration shifts, or `None` if registration
+        isn't enabled in `corrections`.
+        """
         self._load_metadata()
-        return self._arr.compute()
+        return None if self._corrections is None else self._corrections.shifts
 
-    def read_partition(self, i: int) -> np.ndarray:
-        return self._get_partition(i).compute()
+    def read(self) -> "np.ndarray":
+        self._load_metadata()
+        with instrument.phase(self, "read", self.path) as ph:
+            out = self._arr.compute()
+            ph.add_bytes(out.nbytes)
+        return out
+
+    def read_partition(self, i: int) -> "np.ndarray":
+        block = self._get_partition(i)
+        with instrument.phase(self, "read", self.path) as ph:
+            out = block.compute()
+            ph.add_bytes(out.nbytes)
+        return out
 
     def _close(self) -> None:
+        if self._frames is not None:
+            self._frames.close()
+        for stack in self._tiffs or ():
+            stack.close()
         self._schema = None
         self._memmap = None
+        self._reader = None
+        self._tiffs = None
         self._arr = None
+        self._frames = None
+        self._corrections = None
+
+    def _frame_reader(self) -> FrameReader:
+        self._load_metadata()
+        if self._frames is None:
+            self._frames = FrameReader(
+                self._memmap,
+                cache_bytes=self.frame_cache,
+                readahead=self.readahead,
+                source=self,
+                transform=self._corrections,
+            )
+        return self._frames
 
     def _get_partition(self, i):
         self._load_metadata()
@@ -276,64 +433,163 @@ class ThorImageArraySource(DataSource):
 
         """
 
-        import dask.array
-
         if self._arr is None:
 
-            if not self.path or not os.path.exists(self.path):
-                # locate raw data file
-                if os.path.isdir(self._path):
-                    if not self.pattern:
-                        raise FileNotFoundError(self._path)
-                    self.path = find_file(
-                        self.pattern, root_dir=self._path, absolute=True,
-                    )
-                else:
-                    self.path = find_file(self._path)
+            if self.paths is None and self.path and os.path.exists(self.path):
+                self.paths = [self.path]
+            if not self.paths or not all(map(os.path.exists, self.paths)):
+                # locate raw data file(s)
+                with instrument.phase(self, "find_file", self._path):
+                    self.paths = resolve_files(self._path, self.pattern)
+            self.path = self.paths[0]
 
-            if self.shape is None:
-                parent_dir = Path(self.path).parent
-                md = ThorImageMetadataSource(parent_dir).to_dict()
-                channels = md["frame"]["channels"]
-                if channels != 1:
-                    raise NotImplementedError('unsupport number of channels')
-                frame_shape = md["frame"]["shape"]
-                dtype = np.dtype(md["frame"]["dtype"])
-                framesize = int(np.prod(frame_shape) * dtype.itemsize)
-                filesize = os.stat(self.path).st_size
-                self.shape = (filesize // framesize, *frame_shape)
-                extra_metadata = md
+            if is_tiff(self.path):
+                extra_metadata = self._open_tiff()
             else:
-                extra_metadata = {}
-
+                extra_metadata = self._open_raw()
             self.shape = tuple(self.shape)
-            self.dtype = np.dtype(self.dtype)
 
             if self.chunks is None:
                 self.chunks = [-1] * len(self.shape)
                 self.chunks[0] = self._chunks_arg
 
-            self._memmap = np.memmap(
-                self.path,
-                shape=self.shape,
-                dtype=self.dtype,
-                mode="r",
-            )
-
-            self._arr = dask.array.from_array(self._memmap, chunks=self.chunks)
+            self._arr = stack_to_dask(self._reader, self.chunks)
             self.chunks = self._arr.chunks
 
+            if self.corrections is not None:
+                self._corrections = Corrections.from_config(self.corrections)
+                self._corrections.resolve(self._memmap, path=self.path)
+                self._arr = self._corrections.to_dask(self._arr)
+
         return Schema(
             path=self.path,
             shape=self.shape,
-            dtype=self.dtype,
+            dtype=self._arr.dtype,
             chunks=self.chunks,
             npartitions=1,
+            paths=tuple(self.paths),
+            file_offsets=self._file_offsets(),
+            format="tiff" if self._tiffs else "raw",
+            corrections=repr(self._corrections) if self._corrections else None,
             extra_metadata=extra_metadata,
         )
 
+    def _file_offsets(self) -> Tuple[int, ...]:
+        """Index of the first frame of each file."""
+        readers = getattr(self._reader, "readers", (self._reader,))
+        offsets = [0]
+        for reader in readers[:-1]:
+            offsets.append(offsets[-1] + reader.shape[0])
+        return tuple(offsets)
+
+    def _frame_metadata(self, required: bool = True) -> Mapping:
+        md_source = self._metadata_source
+        if md_source is None:
+            md_source = ThorImageMetadataSource(Path(self.path).parent)
+        try:
+            md = md_source.to_dict()
+        except FileNotFoundError:
+            if required:
+                raise
+            return {}
+        if md["frame"]["channels"] != 1:
+            raise NotImplementedError('unsupport number of channels')
+        return md
+
+    def _open_raw(self) -> Mapping:
+        import numpy as np
+
+        self.dtype = np.dtype(self.dtype)
+        if self.shape is None:
+            md = self._frame_metadata()
+            frame_shape = tuple(md["frame"]["shape"])
+            framesize = int(np.prod(frame_shape)) * \
+                np.dtype(md["frame"]["dtype"]).itemsize
+            extra_metadata = md
+        else:
+            frame_shape = tuple(self.shape[1:])
+            framesize = int(np.prod(frame_shape)) * self.dtype.itemsize
+            extra_metadata = {}
+
+        # Frames per file, from file sizes. The index of each file's first
+        # frame follows from these.
+        if self.shape is not None and len(self.paths) == 1:
+            counts = [self.shape[0]]
+        else:
+            counts = []
+            for path in self.paths:
+                n_frames, remainder = divmod(os.stat(path).st_size, framesize)
+                if remainder:
+                    warnings.warn(
+                        f"{path} ends with a partial frame "
+                        f"({remainder} of {framesize} bytes); ignoring it",
+                    )
+                counts.append(n_frames)
+            if self.shape is not None and sum(counts) != self.shape[0]:
+                raise ValueError(
+                    f"shape {tuple(self.shape)} doesn't match the "
+                    f"{sum(counts)} frames in {len(self.paths)} files"
+                )
+        self.shape = (sum(counts), *frame_shape)
+
+        readers = [
+            BlockReader(path, (n, *frame_shape), self.dtype)
+            for path, n in zip(self.paths, counts)
+        ]
+        with instrument.phase(self, "open", self.path) as ph:
+            if len(readers) == 1:
+                self._reader = readers[0]
+                self._memmap = np.memmap(
+                    self.path,
+                    shape=tuple(self.shape),
+                    dtype=self.dtype,
+                    mode="r",
+                )
+            else:
+                # split stack: one mapping per file, joined virtually
+                self._reader = ConcatReader(readers)
+                self._memmap = self._reader.open()
+            ph.add_open(len(readers))
+        return extra_metadata
+
+    def _open_tiff(self) -> Mapping:
+        # Shape and dtype come from the files; the xml is only metadata.
+        extra_metadata = self._frame_metadata(required=False) \
+            if self.shape is None else {}
+        readers, views = [], []
+        with instrument.phase(self, "open", self.path) as ph:
+            self._tiffs = [TiffStack(path, source=self) for path in self.paths]
+            for stack in self._tiffs:
+                layout = stack.layout()
+                if layout is None:
+                    # compressed or irregular: read through the page decoder
+                    readers.append(BlockReader(stack.path, stack.shape,
+                                               stack.dtype, kind="tiff"))
+                    views.append(stack)
+                else:
+                    offset, strides = layout
+                    readers.append(BlockReader(stack.path, stack.shape,
+                                               stack.dtype, offset=offset,
+                                               strides=strides))
+                    views.append(stack.memmap())
+            ph.add_open(len(readers))
+        if len(readers) == 1:
+            self._reader, self._memmap = readers[0], views[0]
+        else:
+            self._reader = ConcatReader(readers)
+            self._memmap = ConcatArray(views)
+        if self.shape is not None and tuple(self.shape) != self._reader.shape:
+            raise ValueError(
+                f"shape {tuple(self.shape)} doesn't match {self.path} "
+                f"{self._reader.shape}"
+            )
+        self.shape = self._reader.shape
+        self.dtype = self._reader.dtype
+        return extra_metadata
+
     def _load_metadata(self):
         """load metadata only if needed"""
 
         if self._schema is None:
             self._schema = self._get_schema()
+
@@ -1,20 +1,34 @@
 import os
 from numbers import Number
 from typing import (
+    TYPE_CHECKING,
+    Any,
     ClassVar,
     Container,
+    Dict,
+    List,
     Mapping,
     Optional,
+    Sequence,
     Set,
+    Tuple,
+    Union,
 )
 
-import fsspec
-import h5py
-import numpy as np
-import pandas as pd
 from intake.source.base import DataSource, Schema
 
+from . import instrument
+from .columnar import COLUMNAR_FORMATS, columnar_schema, infer_format, read_columnar
 from .common import *
+from .concat import ConcatArray
+from .h5pool import get_pool
+
+if TYPE_CHECKING:
+    import h5py
+    import numpy as np
+    import pandas as pd
+
+    from .runs import RunLengthLine
 
 __all__ = [
     "ThorSyncSource",
@@ -27,13 +41,34 @@ class ThorSyncSource(DataSource):
 
     Parameters
     ----------
-    path: path-like
-    Path to h5 file. Usually called 'Episode001.h5'.
+    path: path-like or list of path-like
+    Path to h5 file. Usually called 'Episode001.h5'. A directory is searched
+    with `pattern`; if several files match (an episode split by ThorSync), or
+    `path` is a list of files, they are concatenated without copying.
 
     binary: iterable of str
     Digital lines carrying binary data. Values are squashed into {0, 1} and the dtype is cast to np.int8.
 
+    memmap: bool
+    If `True` (default), contiguous uncompressed datasets are accessed through
+    read-only memory maps rather than read into memory. Chunked or compressed
+    datasets are always read through h5py.
+
+    columns: iterable of str, optional
+    Columns to load. Defaults to all of them.
+
+    time_range: (float, float), optional
+    Only load samples with ``start <= time < stop``, in seconds.
 
+    format: str, optional
+    "h5", "parquet" or "arrow". Inferred from the path's suffix if not given.
+    Columnar files are written by `columnar.export_sync`; `path` may also be
+    a directory of them, read as one dataset with `columns` and `time_range`
+    pushed down to the reader.
+
+    resolved: bool
+    If `True`, `path` is the h5 file (or list of files) to read, already
+    resolved, and no search is made.
 
     """
 
@@ -44,20 +79,36 @@ class ThorSyncSource(DataSource):
 
     def __init__(
         self,
-        path: PathLike,
+        path: Union[PathLike, Sequence[PathLike]],
         *,
         binary: Optional[Container[str]] = None,
         clock_rate: Number = 20_000_000,
         pattern: str = "Episode*.h5",
+        memmap: bool = True,
+        columns: Optional[Sequence[str]] = None,
+        time_range: Optional[Tuple[float, float]] = None,
+        format: Optional[str] = None,
         metadata: Optional[Mapping] = None,
+        resolved: bool = False,
     ):
         super().__init__(metadata=metadata)
         self._path = path
-        self.path = None
+        self.path = None  # first (or only) file. set once known.
+        self.paths = None  # all files, in order
+        if resolved:
+            paths = path if isinstance(path, (list, tuple)) else [path]
+            self.paths = [os.path.abspath(os.fspath(p)) for p in paths]
+            self.path = self.paths[0]
         self.binary = binary
         self.clock_rate = clock_rate
         self.pattern = pattern
+        self.memmap = memmap
+        self.columns = tuple(columns) if columns is not None else None
+        self.time_range = tuple(time_range) if time_range is not None else None
+        self.format = format
         self._dataframe = None
+        self._views = None
+        self._runs = None  # name -> RunLengthLine, set by `to_runs`
 
     @property
     def binary(self) -> Set:
@@ -69,35 +120,119 @@ class ThorSyncSource(DataSource):
 
     def get_schema(self) -> Schema:
         self._load_metadata()
-        return self._get_schema()
+        return self._schema
+
+    async def get_schema_async(self) -> Schema:
+        """
+        `get_schema`, run on the shared "h5" executor (see `aio`). Columnar
+        files use the "io" executor.
+        """
+        from .aio import get_executor
+
+        kind = "io" if self._format() in COLUMNAR_FORMATS else "h5"
+        return await get_executor(kind).run(self.get_schema)
+
+    def to_memmap(self) -> Dict[str, "np.ndarray"]:
+        """
+        Return the raw lines as 1-d read-only arrays without copying them.
+
+        Keys are 'GCtr' followed by the names of the analog and digital
+        lines. Values are memory maps for contiguous, uncompressed datasets
+        and in-memory arrays otherwise. No dtype conversion is applied. For
+        episodes split across files, each value is a `concat.ConcatArray`
+        joining the files' views.
+        """
+        self._load_metadata()
+        if self._views is None:
+            self._views = self._load_views()
+        return dict(self._views)
+
+    def to_runs(
+        self,
+        names: Optional[Sequence[str]] = None,
+        chunk_size: int = 2 ** 22,
+    ) -> Dict[str, "RunLengthLine"]:
+        """
+        Return digital lines run-length encoded, as `runs.RunLengthLine`s.
+
+        Lines are encoded in one streaming pass over their memory maps and
+        cached, so memory use scales with the number of transitions rather
+        than samples. Values match `read`: binary lines are squashed into
+        {0, 1} as int8, other lines are int32.
+
+        Parameters
+        ----------
+        names: iterable of str, optional
+            Digital lines to encode. Defaults to all of them.
+        chunk_size: int, optional
+            Samples processed per step of the encoding pass.
+
+        """
+        import numpy as np
+
+        from .runs import encode_line
+
+        self._load_metadata()
+        digital = self._schema["datasets"]["DI"]
+        names = digital if names is None else tuple(names)
+        unknown = [name for name in names if name not in digital]
+        if unknown:
+            raise KeyError(f"not digital lines: {unknown}")
+        if self._runs is None:
+            self._runs = {}
+        missing = [name for name in names if name not in self._runs]
+        if missing:
+            views = self.to_memmap()
+            for name in missing:
+                binary = name in self.binary
+                self._runs[name] = encode_line(
+                    views[name],
+                    views["GCtr"],
+                    self.clock_rate,
+                    binary=binary,
+                    dtype=np.int8 if binary else np.int32,
+                    chunk_size=chunk_size,
+                    source=self,
+                )
+        return {name: self._runs[name] for name in names}
 
     def _close(self) -> None:
         self._schema = None
         self._dataframe = None
+        self._views = None
+        self._runs = None
 
     def _get_partition(self, i):
         """Subclasses should return a container object for this partition
         This function will never be called with an out-of-range value for i.
         """
+        with instrument.phase(self, "cache") as ph:
+            if self._dataframe is None:
+                ph.miss()
+            else:
+                ph.hit()
         if self._dataframe is None:
             self._dataframe = self._load_dataframe()
         return self._dataframe
 
     def _get_schema(self) -> Schema:
 
-        if not self.path or not os.path.exists(self.path):
-            # locate raw data file
-            if os.path.isdir(self._path):
-                if not self.pattern:
-                    raise FileNotFoundError(self._path)
-                self.path = find_file(
-                    self.pattern, root_dir=self._path, absolute=True,
-                )
-            else:
-                self.path = find_file(self._path)
+        import numpy as np
+
+        fmt = self._format()
+        if fmt in COLUMNAR_FORMATS:
+            return self._get_columnar_schema(fmt)
+
+        if self.paths is None and self.path and os.path.exists(self.path):
+            self.paths = [self.path]
+        if not self.paths or not all(map(os.path.exists, self.paths)):
+            # locate raw data file(s)
+            with instrument.phase(self, "find_file", self._path):
+                self.paths = resolve_files(self._path, self.pattern)
+        self.path = self.paths[0]
 
-        with fsspec.open_files(self.path, "rb")[0] as file:
-            with h5py.File(file, "r") as f:
+        with instrument.phase(self, "open_h5", self.path) as ph:
+            with get_pool().acquire(self.path, ph) as f:
                 clock = f['Global']['GCtr']
                 length = clock.shape[0]
                 dtypes = {"time": np.float64}
@@ -110,7 +245,28 @@ class ThorSyncSource(DataSource):
                 for name, dset in DI.items():
                     if name in self.binary:
                         dtypes[name] = np.int8
-
+                    else:
+                        dtypes[name] = np.int32
+
+                datasets = {"AI": tuple(AI.keys()), "DI": tuple(DI.keys())}
+
+            # Episodes split across files: one sample offset per file.
+            offsets = [0]
+            for path in self.paths[1:]:
+                offsets.append(offsets[-1] + length)
+                with get_pool().acquire(path, ph) as f:
+                    names = {"AI": tuple(f["AI"].keys()),
+                             "DI": tuple(f["DI"].keys())}
+                    if names != datasets:
+                        raise ValueError(
+                            f"{path} has different lines than {self.path}"
+                        )
+                    length = f["Global"]["GCtr"].shape[0]
+            length += offsets[-1]
+
+        dtypes = self._project(dtypes)
+        if self.time_range is not None:
+            length = None  # known once the clock is searched on read
         shape = (length, len(dtypes))
         columns = tuple(dtypes.keys())
 
@@ -119,53 +275,205 @@ class ThorSyncSource(DataSource):
             shape=shape,
             npartitions=1,
             path=self.path,
+            paths=tuple(self.paths),
+            file_offsets=tuple(offsets),
+            format="h5",
             columns=columns,
             dtypes=dtypes,
+            datasets=datasets,
+            extra_metadata={},
+        )
+
+    def _get_columnar_schema(self, fmt: str) -> Schema:
+        if isinstance(self._path, (list, tuple)):
+            self.paths = resolve_files(self._path)
+        else:
+            self.paths = [os.path.abspath(os.path.expanduser(self._path))]
+        self.path = self.paths[0]
+        with instrument.phase(self, "open_columnar", self.path):
+            dtypes, length = columnar_schema(self._columnar_path(), fmt)
+        dtypes = self._project(dtypes)
+        if self.time_range is not None:
+            length = None
+        return Schema(
+            dtype=None,
+            shape=(length, len(dtypes)),
+            npartitions=1,
+            path=self.path,
+            paths=tuple(self.paths),
+            format=fmt,
+            columns=tuple(dtypes.keys()),
+            dtypes=dtypes,
             extra_metadata={},
         )
 
+    def _columnar_path(self) -> Union[str, List[str]]:
+        return self.paths if len(self.paths) > 1 else self.path
+
+    def _project(self, dtypes: Dict[str, Any]) -> Dict[str, Any]:
+        if self.columns is None:
+            return dtypes
+        missing = [c for c in self.columns if c not in dtypes]
+        if missing:
+            raise KeyError(f"unknown columns: {missing}")
+        return {c: dtypes[c] for c in self.columns}
+
     def _load_metadata(self) -> None:
         if self._schema is None:
             self._schema = self._get_schema()
 
-    def _load_dataframe(self) -> pd.DataFrame:
+    def _load_dataframe(self) -> "pd.DataFrame":
         """
         Load the h5 data into a dataframe and return it.
         """
-        self._load_metadata()
+        import numpy as np
+        import pandas as pd
 
-        file = fsspec.open_files(self.path, "rb")[0]
-        with file as f_inner:
-            with h5py.File(f_inner, "r") as f:
-                data = {}
-                # Create time array from 20 kHz clock ticks. Thorsync's
-                # metadata file has samplerate entries, but Thorlabs'
-                # house-made matlab scripts have this value hard-corded in.
-                # Also, this value isn't one of the samplerates listed in
-                # the metadata file ('ThorRealTimeDataSettings.xml').
-                clock_rate = self.clock_rate
-                clock = f["Global"]["GCtr"][:].reshape(-1)
-                data['time'] = clock / clock_rate
-
-                # Load analog lines.
-                for name, dset in f['AI'].items():
-                    arr = dset[:].reshape(-1)
-                    data[name] = arr
-
-                # Load digital lines.
-                for name, dset in f['DI'].items():
-                    arr = dset[:].reshape(-1)
-                    if name in self._binary:
-                        # For some reason, some digital lines that should
-                        # carry only 0s or 1s have 0s and 2s or 0s and 16s.
-                        # Clip them here.
-                        arr = np.clip(arr, 0, 1).astype(np.int8)
-                    else:
-                        # Prefer signed integers to avoid pitfalls with diff.
-                        arr = arr.astype(np.int32)
-                    data[name] = arr
+        self._load_metadata()
+        if self._schema["format"] != "h5":
+            with instrument.phase(self, "read", self.path) as ph:
+                return read_columnar(
+                    self._columnar_path(),
+                    self._schema["format"],
+                    columns=self.columns,
+                    time_range=self.time_range,
+                    recorder=ph,
+                )
 
-        df = pd.DataFrame(data)
+        views = self.to_memmap()
+        ds_names = self._schema["datasets"]
+        wanted = set(self._schema["columns"])
+
+        with instrument.phase(self, "read", self.path) as ph:
+            data = {}
+            # Create time array from 20 kHz clock ticks. Thorsync's
+            # metadata file has samplerate entries, but Thorlabs'
+            # house-made matlab scripts have this value hard-corded in.
+            # Also, this value isn't one of the samplerates listed in
+            # the metadata file ('ThorRealTimeDataSettings.xml').
+            clock_rate = self.clock_rate
+            clock = views["GCtr"]
+            rows = slice(None)
+            if self.time_range is not None:
+                # GCtr is monotonic, so the range maps to one slice.
+                start, stop = self.time_range
+                rows = slice(
+                    _time_index(clock, start, clock_rate),
+                    _time_index(clock, stop, clock_rate),
+                )
+            clock = clock[rows]
+            ph.add_bytes(clock.nbytes)
+            data['time'] = clock / clock_rate
+
+            # Load analog lines.
+            for name in ds_names["AI"]:
+                if name not in wanted:
+                    continue
+                arr = views[name][rows]
+                ph.add_bytes(arr.nbytes)
+                data[name] = arr
+
+            # Load digital lines.
+            for name in ds_names["DI"]:
+                if name not in wanted:
+                    continue
+                arr = views[name][rows]
+                ph.add_bytes(arr.nbytes)
+                if name in self._binary:
+                    # For some reason, some digital lines that should
+                    # carry only 0s or 1s have 0s and 2s or 0s and 16s.
+                    # Clip them here.
+                    arr = np.clip(arr, 0, 1).astype(np.int8)
+                else:
+                    # Prefer signed integers to avoid pitfalls with diff.
+                    arr = arr.astype(np.int32)
+                data[name] = arr
+
+            df = pd.DataFrame(data)
+            if self.columns is not None:
+                df = df[list(self.columns)]
 
         return df
 
+    def _load_views(self) -> Dict[str, "np.ndarray"]:
+        parts = []
+        with instrument.phase(self, "memmap", self.path) as ph:
+            for path in self.paths:
+                views = {}
+                with get_pool().acquire(path, ph) as f:
+                    views["GCtr"] = self._dataset_view(
+                        f["Global"]["GCtr"], path, ph,
+                    )
+                    for group in ("AI", "DI"):
+                        for name, dset in f[group].items():
+                            views[name] = self._dataset_view(dset, path, ph)
+                parts.append(views)
+        if len(parts) == 1:
+            return parts[0]
+        # split episode: join each line's per-file views virtually
+        return {
+            name: ConcatArray([views[name] for views in parts])
+            for name in parts[0]
+        }
+
+    def _format(self) -> str:
+        if self.format:
+            return self.format
+        path = self._path
+        if isinstance(path, (list, tuple)):
+            path = path[0]
+        return infer_format(os.fspath(path))
+
+    def _dataset_view(
+        self,
+        dset: "h5py.Dataset",
+        path: str,
+        recorder: Any,
+    ) -> "np.ndarray":
+        """
+        Return a flat, read-only view of `dset`.
+
+        Contiguous, unfiltered datasets stored in the file itself are mapped
+        directly from their file offset. Anything else (chunked, compressed,
+        compact or external storage) is read through h5py.
+        """
+        import h5py
+        import numpy as np
+
+        if self.memmap and dset.chunks is None:
+            plist = dset.id.get_create_plist()
+            offset = dset.id.get_offset()
+            if (
+                plist.get_layout() == h5py.h5d.CONTIGUOUS
+                and plist.get_external_count() == 0
+                and offset is not None
+                and dset.dtype.kind in "biuf"
+            ):
+                recorder.add_open()
+                arr = np.memmap(
+                    path,
+                    dtype=dset.dtype,
+                    mode="r",
+                    offset=offset,
+                    shape=dset.shape,
+                )
+                return arr.reshape(-1)
+
+        arr = dset[()].reshape(-1)
+        arr.flags.writeable = False
+        recorder.add_bytes(arr.nbytes)
+        return arr
+
+
+def _time_index(clock: "np.ndarray", t: float, clock_rate: float) -> int:
+    """First index with ``clock / clock_rate >= t``, for a monotonic clock."""
+    import numpy as np
+
+    i = int(np.searchsorted(clock, t * clock_rate, "left"))
+    # t * clock_rate can round across a tick; settle the boundary in the
+    # same units the time column is computed in.
+    while i > 0 and clock[i - 1] / clock_rate >= t:
+        i -= 1
+    while i < len(clock) and clock[i] / clock_rate < t:
+        i += 1
+    return i
@@ -0,0 +1,394 @@
+"""
+Memory-mapped access to TIFF and OME-TIFF frame stacks.
+
+Files are parsed with tifffile (``pip install intake_thorlabs[tiff]``) once per
+file version and reduced to a compact table of per-page strip (or tile)
+offsets and byte counts, which is cached for the life of the process. Stacks
+of uncompressed, single-strip-run pages laid out at a regular stride -- what
+ThorImage, ImageJ and OME writers produce -- are served as zero-copy views of
+one file memmap. Anything else (compressed or irregular pages) is decoded
+page by page by tifffile, with pages decoded in parallel on a thread pool.
+
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from . import instrument
+from .common import PathLike
+
+if TYPE_CHECKING:
+    import numpy as np
+
+__all__ = [
+    "TIFF_SUFFIXES",
+    "TiffStack",
+    "is_tiff",
+    "open_tiff",
+]
+
+TIFF_SUFFIXES = (".tif", ".tiff", ".btf", ".tf8")
+
+_INDEX_CACHE_SIZE = 64
+_index_cache: "OrderedDict[Tuple[str, int, int], TiffIndex]" = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def is_tiff(path: PathLike) -> bool:
+    """Return `True` if `path` has a TIFF file suffix."""
+    return os.path.splitext(os.fspath(path))[1].lower() in TIFF_SUFFIXES
+
+
+class TiffIndex:
+    """
+    Parsed layout of a TIFF stack.
+
+    Attributes
+    ----------
+    shape: tuple of int
+        (pages, height, width).
+    dtype: numpy.dtype
+        Pixel dtype, in the file's byte order.
+    compression: int
+        TIFF compression code (1 is uncompressed).
+    predictor: int
+        TIFF predictor code (1 is none).
+    offsets, counts: ndarray
+        (pages, segments) int64 arrays of strip or tile offsets and byte
+        counts.
+    pages: tuple of int
+        Position of each page in the file's IFD chain (reduced-resolution
+        images are skipped).
+    tiled: bool
+    description: str
+        ImageDescription of the first page.
+
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, int, int],
+        dtype: "np.dtype",
+        compression: int,
+        predictor: int,
+        offsets: "np.ndarray",
+        counts: "np.ndarray",
+        pages: Tuple[int, ...],
+        tiled: bool,
+        description: str,
+    ):
+        self.shape = shape
+        self.dtype = dtype
+        self.compression = compression
+        self.predictor = predictor
+        self.offsets = offsets
+        self.counts = counts
+        self.pages = pages
+        self.tiled = tiled
+        self.description = description
+
+    @property
+    def ome(self) -> bool:
+        return "<OME" in self.description[:1024]
+
+    def page_stride(self) -> Optional[int]:
+        """
+        Byte stride between pages if every page is one uncompressed run of
+        bytes at a regular stride, else `None`.
+        """
+        import numpy as np
+
+        if self.compression != 1 or self.predictor != 1 or self.tiled:
+            return None
+        offsets, counts = self.offsets, self.counts
+        # strips of each page must follow one another
+        if offsets.shape[1] > 1:
+            if np.any(offsets[:, 1:] != offsets[:, :-1] + counts[:, :-1]):
+                return None
+        frame_bytes = int(np.prod(self.shape[1:])) * self.dtype.itemsize
+        if np.any(counts.sum(axis=1) < frame_bytes):
+            return None
+        starts = offsets[:, 0]
+        if len(starts) == 1:
+            return frame_bytes
+        steps = np.diff(starts)
+        if np.any(steps != steps[0]) or steps[0] < frame_bytes:
+            return None
+        return int(steps[0])
+
+
+class TiffStack:
+    """
+    Array-like (pages, height, width) view of a TIFF stack.
+
+    Indexing along the first axis reads and decodes only the selected pages.
+    Instances pickle by path and offset table, so they can be shipped to
+    other processes.
+
+    Parameters
+    ----------
+    path: path-like
+        TIFF file.
+    n_workers: int, optional
+        Threads used to decode compressed pages. Defaults to the number of
+        CPUs.
+    source: optional
+        Source (or name) to record instrumentation against.
+
+    """
+
+    def __init__(
+        self,
+        path: PathLike,
+        n_workers: Optional[int] = None,
+        source: Optional[Any] = None,
+    ):
+        self.path = os.path.abspath(os.fspath(path))
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.source = source if source is not None else "tiff"
+        self.index = _get_index(self.path, self.source)
+        self._tif = None
+        self._pages = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._io_lock = threading.RLock()
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.index.shape
+
+    @property
+    def dtype(self) -> "np.dtype":
+        return self.index.dtype
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    @property
+    def nbytes(self) -> int:
+        import numpy as np
+
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def layout(self) -> Optional[Tuple[int, Tuple[int, int, int]]]:
+        """
+        Return the file offset and byte strides of the pages, or `None` if
+        they can't be mapped (compressed or irregularly laid out).
+        """
+        stride = self.index.page_stride()
+        if stride is None:
+            return None
+        itemsize = self.dtype.itemsize
+        width = self.shape[2]
+        offset = int(self.index.offsets[0, 0])
+        return offset, (stride, width * itemsize, itemsize)
+
+    def memmap(self) -> Optional["np.ndarray"]:
+        """
+        Return a read-only zero-copy view of all pages, or `None` if the
+        pages can't be mapped (compressed or irregularly laid out).
+        """
+        import numpy as np
+
+        layout = self.layout()
+        if layout is None:
+            return None
+        offset, strides = layout
+        n, height, width = self.shape
+        frame_bytes = height * width * self.dtype.itemsize
+        if strides[0] == frame_bytes:
+            return np.memmap(self.path, dtype=self.dtype, mode="r",
+                             offset=offset, shape=self.shape)
+        # IFDs sit between the pages: map the whole span and stride over it.
+        span = np.memmap(self.path, dtype=np.uint8, mode="r", offset=offset,
+                         shape=(strides[0] * (n - 1) + frame_bytes,))
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=span,
+                          strides=strides)
+
+    def __getitem__(self, key: Any) -> "np.ndarray":
+        import numpy as np
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = key[0], key[1:]
+        n = self.shape[0]
+        if isinstance(first, (int, np.integer)):
+            index = int(first) + n if first < 0 else int(first)
+            if not 0 <= index < n:
+                raise IndexError(f"page {first} out of range")
+            return self._read([index])[(0, *rest)]
+        if isinstance(first, slice):
+            indices = range(*first.indices(n))
+        elif first is Ellipsis:
+            return self._read(range(n))[key]
+        else:
+            indices = np.arange(n)[first]
+        return self._read(indices)[(slice(None), *rest)]
+
+    def __array__(self, dtype=None) -> "np.ndarray":
+        import numpy as np
+
+        return np.asarray(self[:], dtype=dtype)
+
+    def __dask_tokenize__(self) -> Tuple:
+        st = os.stat(self.path)
+        return (type(self).__name__, self.path, st.st_size, st.st_mtime_ns)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_tif"] = None
+        state["_pages"] = None
+        state["_executor"] = None
+        del state["_lock"], state["_io_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._io_lock = threading.RLock()
+
+    def __repr__(self) -> str:
+        return f"TiffStack({self.path!r}, shape={self.shape}, " \
+               f"dtype={str(self.dtype)!r}, " \
+               f"compression={self.index.compression})"
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            tif, self._tif = self._tif, None
+            self._pages = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if tif is not None:
+            tif.close()
+
+    def _read(self, indices: Sequence[int]) -> "np.ndarray":
+        import numpy as np
+
+        indices = list(indices)
+        out = np.empty((len(indices), *self.shape[1:]), dtype=self.dtype)
+        pages = self._open_pages()
+        with instrument.phase(self.source, "decode", self.path) as ph:
+            def work(item):
+                pos, index = item
+                page = pages[index]
+                # reads are serialized on the file handle, decoding isn't
+                out[pos] = page.asarray(lock=self._io_lock, maxworkers=1)
+                return int(sum(page.databytecounts))
+
+            items = list(enumerate(indices))
+            if len(items) > 1 and self.n_workers > 1:
+                nbytes = sum(self._pool().map(work, items))
+            else:
+                nbytes = sum(map(work, items))
+            ph.add_bytes(nbytes)
+        return out
+
+    def _open_pages(self) -> List[Any]:
+        import tifffile
+
+        with self._lock:
+            if self._pages is None:
+                self._tif = tifffile.TiffFile(self.path)
+                self._pages = [self._tif.pages[i] for i in self.index.pages]
+            return self._pages
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.n_workers,
+                    thread_name_prefix="intake_thorlabs-tiff",
+                )
+            return self._executor
+
+
+def open_tiff(
+    path: PathLike,
+    n_workers: Optional[int] = None,
+    source: Optional[Any] = None,
+) -> TiffStack:
+    """Open a TIFF stack. See `TiffStack`."""
+    return TiffStack(path, n_workers=n_workers, source=source)
+
+
+def _get_index(path: str, source: Any) -> TiffIndex:
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    with instrument.phase(source, "parse_tiff", path) as ph:
+        with _index_lock:
+            index = _index_cache.get(key)
+            if index is not None:
+                _index_cache.move_to_end(key)
+        if index is not None:
+            ph.hit()
+            return index
+        ph.miss()
+        ph.add_open()
+        index = _parse(path)
+        with _index_lock:
+            _index_cache[key] = index
+            while len(_index_cache) > _INDEX_CACHE_SIZE:
+                _index_cache.popitem(last=False)
+    return index
+
+
+def _parse(path: str) -> TiffIndex:
+    import numpy as np
+    import tifffile
+
+    with tifffile.TiffFile(path) as tif:
+        numbers = []
+        pages = []
+        for number, page in enumerate(tif.pages):
+            if page.is_reduced:
+                continue
+            numbers.append(number)
+            pages.append(page)
+        if not pages:
+            raise ValueError(f"no images in {path}")
+        first = pages[0]
+        if len(first.shape) != 2:
+            raise NotImplementedError("only single-sample (grayscale) pages "
+                                      "are supported")
+        layout = _page_layout(first)
+        for number, page in zip(numbers[1:], pages[1:]):
+            if _page_layout(page) != layout:
+                raise ValueError(f"page {number} of {path} differs in shape, "
+                                 f"dtype or compression from page 0")
+        try:
+            offsets = np.array([p.dataoffsets for p in pages], dtype=np.int64)
+            counts = np.array([p.databytecounts for p in pages],
+                              dtype=np.int64)
+        except ValueError:
+            raise ValueError(f"pages of {path} differ in strip layout") \
+                from None
+        return TiffIndex(
+            shape=(len(pages), *first.shape),
+            dtype=first.dtype.newbyteorder(tif.byteorder),
+            compression=int(first.compression),
+            predictor=int(first.predictor),
+            offsets=offsets,
+            counts=counts,
+            pages=tuple(numbers),
+            tiled=bool(first.is_tiled),
+            description=first.description or "",
+        )
+
+
+def _page_layout(page: Any) -> Tuple[Any, ...]:
+    return (page.shape, page.dtype, int(page.compression),
+            int(page.predictor), page.is_tiled)
@@ -21,6 +21,7 @@ setup(
             'thorimagemetadata = intake_thorlabs.thorimage:ThorImageMetadataSource',
             'thorimagearray = intake_thorlabs.thorimage:ThorImageArraySource',
             'thorsync = intake_thorlabs.thorsync:ThorSyncSource',
+            'thorexperiment = intake_thorlabs.experiment:ThorExperimentSource',
         ]
     },
     classifiers=[
@@ -32,7 +33,7 @@ setup(
     python_requires=">=3.7",
     include_package_data=True,
     install_requires=requires,
-    extras_require={},
+    extras_require={"parquet": ["pyarrow"], "tiff": ["tifffile"]},
     long_description_content_type='text/markdown',
     long_description=open('README.md').read(),
     zip_safe=False,
@@ -1,6 +1,10 @@
 import io
+import os
 from os import PathLike
 from pathlib import Path
+import subprocess
+import sys
+import tempfile
 from types import SimpleNamespace
 from typing import Mapping, Tuple, Union
 import unittest
@@ -8,9 +12,17 @@ from unittest import TestCase
 import xml
 from xml.etree import ElementTree
 
+import h5py
 import numpy as np
 import pandas as pd
 from intake_thorlabs import *
+from intake_thorlabs import instrument
+from intake_thorlabs.columnar import export_sync
+from intake_thorlabs.corrections import Corrections, estimate_bidi_phase
+from intake_thorlabs.frames import FrameCache
+from intake_thorlabs.integrity import check_session, check_sessions
+from intake_thorlabs.registration import register_frames
+from intake_thorlabs.h5pool import H5HandlePool, get_pool
 
 DATADIR = Path(__file__).parent / "data"
 # dirpath1 = DATADIR / "1"
@@ -18,6 +30,117 @@ DATADIR = Path(__file__).parent / "data"
 # dirpath3 = DATADIR / "3"
 
 
+EXPERIMENT_XML = """<?xml version="1.0"?>
+<ThorImageExperiment>
+  <Software version="4.0.2019.8191" />
+  <Date date="01/02/2022 10:00:00" uTime="1641117600" />
+  <CaptureMode mode="1" />
+  <Modality name="Multiphoton" />
+  <LSM name="GalvoResonance" pixelX="{width}" pixelY="{height}"
+       heightUM="{height}" widthUM="{width}" averageMode="0" averageNum="1"
+       frameRate="30.0" />
+  <Wavelengths>
+    <ChannelEnable Set="1" />
+  </Wavelengths>
+  <PMT enableA="1" gainA="0.5" enableB="0" gainB="0"
+       enableC="0" gainC="0" enableD="0" gainD="0" />
+  <Pockels start="0.1" stop="0.2" />
+</ThorImageExperiment>
+"""
+
+
+# ThorSync samples lines at 30 kHz against a 20 MHz GCtr, so a clean clock
+# steps by 666 or 667 ticks.
+CLOCK_RATE = 20_000_000
+SAMPLE_RATE = 30_000
+
+
+def gctr(n_samples: int) -> np.ndarray:
+    return (np.arange(n_samples) * CLOCK_RATE // SAMPLE_RATE).astype(np.uint64)
+
+
+def make_session(
+    dirpath: Path,
+    n_frames: int = 20,
+    shape: Tuple[int, int] = (8, 8),
+    n_samples: int = 1000,
+) -> SimpleNamespace:
+    """
+    Write a small synthetic multiphoton session (Experiment.xml, raw stack
+    and ThorSync h5 file) to `dirpath`.
+    """
+    dirpath = Path(dirpath)
+    dirpath.mkdir(parents=True, exist_ok=True)
+    height, width = shape
+    xml_text = EXPERIMENT_XML.format(height=height, width=width)
+    (dirpath / "Experiment.xml").write_text(xml_text)
+
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 4096, size=(n_frames, height, width))
+    frames = frames.astype("<H")
+    frames.tofile(dirpath / "Image_0001_0001.raw")
+
+    clock = gctr(n_samples).reshape(-1, 1)
+    period = n_samples // n_frames
+    frame_out = ((np.arange(n_samples) % period) < period // 2)
+    frame_out = frame_out.astype(np.uint32).reshape(-1, 1) * 2
+    with h5py.File(dirpath / "Episode001.h5", "w") as f:
+        f.create_dataset("Global/GCtr", data=clock)
+        f.create_dataset(
+            "AI/Piezo",
+            data=rng.standard_normal((n_samples, 1)).astype(np.float64),
+        )
+        f.create_dataset("DI/FrameOut", data=frame_out)
+        f.create_dataset(
+            "DI/Strobe", data=np.ones((n_samples, 1), dtype=np.uint32),
+        )
+    return SimpleNamespace(path=dirpath, frames=frames)
+
+
+def _has_module(name: str) -> bool:
+    import importlib.util
+
+    return importlib.util.find_spec(name) is not None
+
+
+def write_tiff(path: PathLike, frames: np.ndarray, compress: bool = False) -> None:
+    """
+    Write a little-endian uint16 stack as a classic TIFF, one strip per page
+    with each page's IFD after its data. `compress` deflates the pages.
+    """
+    import struct
+    import zlib
+
+    n_frames, height, width = frames.shape
+    with open(path, "wb") as f:
+        f.write(b"II*\0" + struct.pack("<I", 0))
+        link = 4  # where the previous "next IFD" offset goes
+        for frame in frames:
+            data = np.ascontiguousarray(frame, dtype="<u2").tobytes()
+            if compress:
+                data = zlib.compress(data)
+            strip = f.tell()
+            f.write(data)
+            f.write(b"\0" * (f.tell() % 2))
+            ifd = f.tell()
+            entries = [
+                (256, 4, width), (257, 4, height), (258, 3, 16),
+                (259, 3, 8 if compress else 1), (262, 3, 1),
+                (273, 4, strip), (277, 3, 1), (278, 4, height),
+                (279, 4, len(data)), (339, 3, 1),
+            ]
+            f.write(struct.pack("<H", len(entries)))
+            for tag, typ, value in entries:
+                fmt = "<HHIH2x" if typ == 3 else "<HHII"
+                f.write(struct.pack(fmt, tag, typ, 1, value))
+            next_link = f.tell()
+            f.write(struct.pack("<I", 0))
+            f.seek(link)
+            f.write(struct.pack("<I", ifd))
+            f.seek(0, 2)
+            link = next_link
+
+
 class TestThorImageMetadata(TestCase):
 
 
@@ -134,5 +257,1059 @@ class TestThorSync(TestCase):
 
 
 
+class TestFrameAccess(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name), n_frames=50)
+
+    def tearDown(self):
+        instrument.disable_stats()
+        instrument.reset_stats()
+        self._tmp.cleanup()
+
+    def test_get_frame(self):
+        src = ThorImageArraySource(self.session.path)
+        frames = self.session.frames
+        for i in [0, 5, -1, 5]:
+            frame = src.get_frame(i)
+            self.assertTrue(np.array_equal(frame, frames[i]))
+            self.assertFalse(frame.flags.writeable)
+        with self.assertRaises(IndexError):
+            src.get_frame(len(frames))
+        out = src.get_frames(slice(3, 20, 2))
+        self.assertTrue(np.array_equal(out, frames[3:20:2]))
+        out = src.get_frames([7, 1, 7])
+        self.assertTrue(np.array_equal(out, frames[[7, 1, 7]]))
+        src.close()
+
+    def test_readahead(self):
+        stats = instrument.enable_stats()
+        src = ThorImageArraySource(self.session.path, readahead=8)
+        for i in range(10, 0, -1):
+            src.get_frame(i)
+        src._frames._executor.shutdown(wait=True)
+        self.assertIn(0, src._frames.cache)
+        get_frame = stats.get("thorimagearray", "get_frame")
+        self.assertGreater(get_frame.cache_hits, 0)
+        self.assertEqual(get_frame.calls, 10)
+        src.close()
+
+    def test_cached_frames_are_compact(self):
+        frames = self.session.frames
+        frame_bytes = frames[0].nbytes
+        src = ThorImageArraySource(self.session.path, frame_cache=4 * frame_bytes,
+                                   readahead=0)
+        out = src.get_frames(slice(0, 50))
+        self.assertTrue(np.array_equal(out, frames))
+        cache = src._frames.cache
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(cache.nbytes, 4 * frame_bytes)
+        for i in range(46, 50):
+            frame = cache.get(i)
+            self.assertTrue(np.array_equal(frame, frames[i]))
+            self.assertTrue(frame.base is None or
+                            frame.base.nbytes <= frame_bytes)
+        frame = src.get_frame(10)
+        self.assertTrue(frame.base is None or frame.base.nbytes <= frame_bytes)
+        self.assertFalse(frame.flags.writeable)
+        src.close()
+
+    def test_cache_bound(self):
+        cache = FrameCache(max_bytes=100)
+        for i in range(5):
+            cache.put(i, np.zeros(40, dtype=np.uint8))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 80)
+        self.assertNotIn(0, cache)
+        self.assertIsNotNone(cache.get(4))
+
+
+@unittest.skipUnless(_has_module("tifffile"), "needs tifffile")
+class TestTiff(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name), n_frames=12)
+        self.frames = self.session.frames
+
+    def tearDown(self):
+        instrument.disable_stats()
+        instrument.reset_stats()
+        self._tmp.cleanup()
+
+    def test_memmap(self):
+        path = self.session.path / "ChanA_0001.tif"
+        write_tiff(path, self.frames)
+        src = ThorImageArraySource(self.session.path, pattern="*.tif", chunks=5)
+        view = src.to_memmap()
+        # IFDs between pages: a strided view of the file, not a copy
+        self.assertIsInstance(view.base, np.memmap)
+        self.assertFalse(view.flags.writeable)
+        self.assertTrue(np.array_equal(view, self.frames))
+        schema = src.get_schema()
+        self.assertEqual(schema["format"], "tiff")
+        self.assertEqual(schema["shape"], self.frames.shape)
+        self.assertEqual(schema["chunks"][0], (5, 5, 2))
+        self.assertEqual(schema["extra_metadata"]["modality"], "multiphoton")
+        self.assertTrue(np.array_equal(src.read_partition(1), self.frames[5:10]))
+        self.assertTrue(np.array_equal(src.get_frame(-1), self.frames[-1]))
+
+    def test_compressed(self):
+        path = self.session.path / "ChanA_0001.tif"
+        write_tiff(path, self.frames, compress=True)
+        stats = instrument.enable_stats()
+        src = ThorImageArraySource(path, chunks=4)
+        self.assertTrue(np.array_equal(src.read(), self.frames))
+        self.assertTrue(np.array_equal(src.get_frames([3, 9]),
+                                       self.frames[[3, 9]]))
+        stack = src.to_memmap()
+        self.assertTrue(np.array_equal(stack[2:5, 1, ::2],
+                                       self.frames[2:5, 1, ::2]))
+        self.assertGreater(stats.get(src.name, "decode").calls, 0)
+        src.close()
+
+    def test_index_cached(self):
+        path = self.session.path / "ChanA_0001.tif"
+        write_tiff(path, self.frames)
+        stats = instrument.enable_stats()
+        ThorImageArraySource(path).discover()
+        ThorImageArraySource(path).discover()
+        parse = stats.get("thorimagearray", "parse_tiff")
+        self.assertEqual((parse.cache_misses, parse.cache_hits), (1, 1))
+
+    def test_tifffile_layouts(self):
+        import tifffile
+
+        from intake_thorlabs.tiff import TiffStack
+
+        frames = self.frames.astype(">u2")
+        layouts = [
+            dict(ome=True), dict(imagej=True), dict(bigtiff=True),
+            dict(byteorder=">"), dict(rowsperstrip=3),
+            dict(tile=(16, 16)), dict(compression="zlib", predictor=True),
+        ]
+        for kw in layouts:
+            path = self.session.path / "stack.tif"
+            tifffile.imwrite(path, frames, **kw)
+            stack = TiffStack(path)
+            self.assertTrue(np.array_equal(stack[:], frames), kw)
+            view = stack.memmap()
+            if view is not None:
+                self.assertTrue(np.array_equal(view, frames), kw)
+            os.remove(path)
+
+
+class TestBlocks(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name), n_frames=40)
+        self.frames = self.session.frames
+
+    def tearDown(self):
+        from intake_thorlabs.blocks import clear_handles
+
+        clear_handles()
+        self._tmp.cleanup()
+
+    def test_graph_is_small(self):
+        import pickle
+
+        src = ThorImageArraySource(self.session.path, chunks=10)
+        arr = src.to_dask()
+        graph = dict(arr.__dask_graph__())
+        self.assertEqual(len(graph), 4)
+        for task in graph.values():
+            self.assertLess(len(pickle.dumps(task)), 1024)
+        self.assertFalse(any(isinstance(t, np.ndarray) for task in
+                             graph.values() for t in task))
+        # deterministic keys for the same file
+        self.assertEqual(
+            arr.name, ThorImageArraySource(self.session.path, chunks=10)
+            .to_dask().name,
+        )
+
+    def test_process_scheduler(self):
+        src = ThorImageArraySource(self.session.path, chunks=7)
+        out = src.to_dask().compute(scheduler="processes", num_workers=2)
+        self.assertTrue(np.array_equal(out, self.frames))
+
+    @unittest.skipUnless(_has_module("tifffile"), "needs tifffile")
+    def test_tiff_readers(self):
+        from intake_thorlabs.blocks import BlockReader, stack_to_dask
+
+        for compress in (False, True):
+            path = self.session.path / "ChanA_0001.tif"
+            write_tiff(path, self.frames, compress=compress)
+            src = ThorImageArraySource(path, chunks=9)
+            arr = src.to_dask()
+            self.assertTrue(np.array_equal(arr.compute(scheduler="sync"),
+                                           self.frames))
+            os.remove(path)
+
+        reader = BlockReader(self.session.path / "Image_0001_0001.raw",
+                             self.frames.shape, "<H")
+        arr = stack_to_dask(reader, (10, 4, 8))
+        self.assertEqual(arr.numblocks, (4, 2, 1))
+        self.assertTrue(np.array_equal(arr[5:15, 3:6].compute(),
+                                       self.frames[5:15, 3:6]))
+
+
+    @unittest.skipUnless(_has_module("tifffile"), "needs tifffile")
+    def test_handles_closed(self):
+        from intake_thorlabs import blocks
+        from intake_thorlabs.blocks import BlockReader, clear_handles
+
+        readers = []
+        for i in range(3):
+            path = self.session.path / f"ChanA_{i:04d}.tif"
+            write_tiff(path, self.frames[:5], compress=True)
+            readers.append(BlockReader(path, (5, 8, 8), "<u2", kind="tiff"))
+        old_max, blocks._MAX_HANDLES = blocks._MAX_HANDLES, 2
+        try:
+            stacks = []
+            for reader in readers:
+                self.assertTrue(np.array_equal(reader((slice(0, 2),)),
+                                               self.frames[:2]))
+                stacks.append(blocks._get_handle(reader))
+            # the least recently used stack was evicted and closed
+            self.assertIsNone(stacks[0]._tif)
+            self.assertIsNotNone(stacks[2]._tif)
+            clear_handles()
+            self.assertTrue(all(stack._tif is None for stack in stacks))
+        finally:
+            blocks._MAX_HANDLES = old_max
+
+
+class TestMultiFile(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name), n_frames=20)
+        self.frames = self.session.frames
+        path = self.session.path
+        # split the stack 12 + 8 frames and the episode 600 + 400 samples
+        self.frames[:12].tofile(path / "Image_0001_0001.raw")
+        self.frames[12:].tofile(path / "Image_0001_0002.raw")
+        with h5py.File(path / "Episode001.h5", "r") as f:
+            self.data = {name: f[key][:] for name, key in [
+                ("GCtr", "Global/GCtr"), ("Piezo", "AI/Piezo"),
+                ("FrameOut", "DI/FrameOut"), ("Strobe", "DI/Strobe"),
+            ]}
+        for name, rows in [("Episode001.h5", slice(0, 600)),
+                           ("Episode002.h5", slice(600, None))]:
+            with h5py.File(path / name, "w") as f:
+                f.create_dataset("Global/GCtr", data=self.data["GCtr"][rows])
+                f.create_dataset("AI/Piezo", data=self.data["Piezo"][rows])
+                for line in ("FrameOut", "Strobe"):
+                    f.create_dataset(f"DI/{line}", data=self.data[line][rows])
+
+    def tearDown(self):
+        from intake_thorlabs.blocks import clear_handles
+
+        clear_handles()
+        get_pool().clear()
+        self._tmp.cleanup()
+
+    def test_image(self):
+        from intake_thorlabs.concat import ConcatArray
+
+        src = ThorImageArraySource(self.session.path, chunks=7)
+        schema = src.get_schema()
+        self.assertEqual(schema["shape"], self.frames.shape)
+        self.assertEqual(len(schema["paths"]), 2)
+        self.assertEqual(schema["file_offsets"], (0, 12))
+        self.assertIsInstance(src.to_memmap(), ConcatArray)
+        # chunk 7:14 crosses the file boundary
+        arr = src.to_dask()
+        self.assertTrue(np.array_equal(arr.compute(scheduler="sync"),
+                                       self.frames))
+        self.assertTrue(np.array_equal(src.read(), self.frames))
+        out = src.get_frames(slice(10, 15))
+        self.assertTrue(np.array_equal(out, self.frames[10:15]))
+        out = src.get_frames([19, 0, 12])
+        self.assertTrue(np.array_equal(out, self.frames[[19, 0, 12]]))
+        # a range inside one file is a view, not a copy
+        self.assertFalse(src.to_memmap()[13:16].flags.owndata)
+        src.close()
+
+        paths = [self.session.path / "Image_0001_0002.raw",
+                 self.session.path / "Image_0001_0001.raw"]
+        src = ThorImageArraySource(paths)
+        self.assertTrue(np.array_equal(
+            src.read(), np.concatenate([self.frames[12:], self.frames[:12]]),
+        ))
+        src.close()
+
+    def test_process_scheduler(self):
+        import pickle
+
+        src = ThorImageArraySource(self.session.path, chunks=7)
+        arr = src.to_dask()
+        for task in dict(arr.__dask_graph__()).values():
+            self.assertLess(len(pickle.dumps(task)), 2048)
+        out = arr.compute(scheduler="processes", num_workers=2)
+        self.assertTrue(np.array_equal(out, self.frames))
+
+    def test_sync(self):
+        from intake_thorlabs.concat import ConcatArray
+
+        src = ThorSyncSource(self.session.path, binary=["FrameOut"])
+        schema = src.get_schema()
+        self.assertEqual(schema["shape"][0], 1000)
+        self.assertEqual(schema["file_offsets"], (0, 600))
+        views = src.to_memmap()
+        self.assertIsInstance(views["Piezo"], ConcatArray)
+        self.assertTrue(np.array_equal(views["Piezo"],
+                                       self.data["Piezo"].reshape(-1)))
+        df = src.read()
+        self.assertEqual(len(df), 1000)
+        self.assertTrue(np.array_equal(df["time"],
+                                       self.data["GCtr"].reshape(-1) / 20e6))
+
+        # time range crossing the file boundary
+        window = ThorSyncSource(self.session.path, binary=["FrameOut"],
+                                time_range=(gctr(551)[-1] / 20e6,
+                                            gctr(651)[-1] / 20e6)).read()
+        self.assertTrue(window.reset_index(drop=True).equals(
+            df.iloc[550:650].reset_index(drop=True)
+        ))
+
+        runs = src.to_runs(["FrameOut"])["FrameOut"]
+        self.assertTrue(np.array_equal(runs.decode(), df["FrameOut"]))
+
+    def test_mismatched_lines(self):
+        with h5py.File(self.session.path / "Episode002.h5", "a") as f:
+            del f["DI/Strobe"]
+        with self.assertRaises(ValueError):
+            ThorSyncSource(self.session.path).get_schema()
+
+    def test_experiment(self):
+        src = ThorExperimentSource(self.session.path, binary=["FrameOut"])
+        self.assertEqual(len(src.paths["image"]), 2)
+        self.assertEqual(len(src.paths["sync"]), 2)
+        self.assertEqual(src.files["image"], src.paths["image"][0])
+        self.assertTrue(np.array_equal(src.image.read(), self.frames))
+        self.assertEqual(len(src.sync.read()), 1000)
+        src.close()
+
+        report = check_session(self.session.path, cache_dir=False)
+        self.assertEqual(report.summary["n_frames"], 20)
+        self.assertNotIn("partial_frame",
+                         {issue["check"] for issue in report.issues})
+
+
+class TestCorrections(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def bidi_frames(self, phase: int) -> np.ndarray:
+        rng = np.random.default_rng(0)
+        row = np.convolve(rng.standard_normal(140), np.ones(5) / 5, "same")
+        img = np.tile(row * 1000 + 2000, (16, 1))
+        img[1::2] = np.roll(img[1::2], -phase, axis=1)
+        return np.stack([img] * 4).astype("<H")[..., 10:-10]
+
+    def test_estimate_bidi_phase(self):
+        frames = self.bidi_frames(3)
+        phase = estimate_bidi_phase(frames)
+        self.assertEqual(phase, 3)
+        out = Corrections(bidi_phase=phase)(frames)
+        self.assertTrue(np.array_equal(out[:, 1, 10:-10], out[:, 0, 10:-10]))
+
+    def test_fused_matches_separate_passes(self):
+        frames = self.session.frames
+        out = Corrections(flip="xy", dark_offset=100, dtype="uint16")(frames)
+        expected = frames[:, ::-1, ::-1].astype(np.float64) - 100
+        expected = np.clip(expected, 0, None).astype(np.uint16)
+        self.assertEqual(out.dtype, np.uint16)
+        self.assertTrue(np.array_equal(out, expected))
+
+    def test_source(self):
+        config = {"flip": "y", "dark_offset": 10, "bidi_phase": 1}
+        src = ThorImageArraySource(
+            self.session.path, chunks=7, corrections=config,
+        )
+        expected = Corrections.from_config(config)(self.session.frames)
+        arr = src.to_dask()
+        self.assertEqual(arr.dtype, np.float32)
+        self.assertTrue(np.array_equal(arr.compute(), expected))
+        self.assertTrue(np.array_equal(src.get_frame(3), expected[3]))
+        self.assertTrue(np.array_equal(src.to_memmap(), self.session.frames))
+        with self.assertRaises(ValueError):
+            Corrections.from_config({"gamma": 2})
+
+
+    def test_graph_carries_block_shifts(self):
+        import pickle
+
+        import dask.array as da
+
+        rng = np.random.default_rng(0)
+        frames = rng.integers(0, 4096, size=(20_000, 8, 8)).astype("<H")
+        pipeline = Corrections(dtype="float32")
+        pipeline.shifts = rng.integers(-2, 3, size=(20_000, 2)) \
+            .astype(np.float32)
+        arr = pipeline.to_dask(da.from_array(frames, chunks=(250, 8, 8)))
+        graph = dict(arr.__dask_graph__())
+        size = max(len(pickle.dumps(task)) for key, task in graph.items()
+                   if key[0] == arr.name)
+        self.assertLess(size, 2048)
+        self.assertIsNotNone(pipeline.shifts)
+        self.assertTrue(np.array_equal(arr[240:260].compute(),
+                                       pipeline(frames)[240:260]))
+
+
+class TestRegistration(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(
+            Path(self._tmp.name), n_frames=30, shape=(32, 32),
+        )
+        # Smooth base image moved around by known integer shifts.
+        rng = np.random.default_rng(0)
+        kernel = np.zeros((32, 32))
+        kernel[:3, :3] = 1 / 9
+        base = np.fft.ifft2(np.fft.fft2(rng.random((32, 32)) * 1000) *
+                            np.fft.fft2(kernel)).real
+        self.base = base
+        self.true = rng.integers(-4, 5, size=(30, 2))
+        frames = np.stack([
+            np.roll(base, tuple(s), axis=(0, 1)) for s in self.true
+        ])
+        frames.astype("<H").tofile(self.session.path / "Image_0001_0001.raw")
+
+    def tearDown(self):
+        instrument.disable_stats()
+        instrument.reset_stats()
+        self._tmp.cleanup()
+
+    def test_register_frames(self):
+        frames = np.stack([
+            np.roll(self.base, tuple(s), axis=(0, 1)) for s in self.true
+        ])
+        ref = self.base.astype(np.float32)
+        shifts = register_frames(frames, ref, chunk_size=4)
+        self.assertTrue(np.array_equal(np.rint(shifts), -self.true))
+        serial = register_frames(frames, ref, chunk_size=4, n_workers=1)
+        self.assertTrue(np.array_equal(shifts, serial))
+
+    def test_source(self):
+        stats = instrument.enable_stats()
+        config = {"register": {"max_shift": 8}}
+        src = ThorImageArraySource(
+            self.session.path, chunks=7, corrections=config,
+        )
+        arr = src.read()
+        sidecar = Path(src.path + ".shifts.npz")
+        self.assertTrue(sidecar.exists())
+        # Registered against the sample mean rather than the base image, so
+        # every frame lands on the same (possibly offset) position.
+        offset = np.rint(src.shifts) + self.true
+        self.assertTrue((offset == offset[0]).all())
+        inner = (slice(None), slice(8, -8), slice(8, -8))
+        self.assertTrue(np.allclose(arr[inner], arr[0][inner[1:]], atol=1))
+        self.assertTrue(np.array_equal(src.get_frame(5), arr[5]))
+
+        src2 = ThorImageArraySource(self.session.path, corrections=config)
+        self.assertTrue(np.array_equal(src2.shifts, src.shifts))
+        sidecar_stats = stats.get("registration", "sidecar")
+        self.assertEqual(
+            (sidecar_stats.cache_hits, sidecar_stats.cache_misses), (1, 1),
+        )
+
+        # shifts of flipped frames aren't the cached shifts of raw frames
+        flipped = ThorImageArraySource(
+            self.session.path, corrections=dict(config, flip="y"),
+        )
+        self.assertTrue(np.array_equal(np.rint(flipped.shifts),
+                                       np.rint(src.shifts) * [-1, 1]))
+        sidecar_stats = stats.get("registration", "sidecar")
+        self.assertEqual(sidecar_stats.cache_misses, 2)
+
+
+class TestIntegrity(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.session = make_session(self.tmp / "session")
+        self.cache_dir = self.tmp / "cache"
+        self.h5_path = self.session.path / "Episode001.h5"
+
+    def tearDown(self):
+        instrument.disable_stats()
+        instrument.reset_stats()
+        get_pool().clear()
+        self._tmp.cleanup()
+
+    def check(self, **kwargs):
+        get_pool().clear()
+        return check_session(
+            self.session.path, cache_dir=self.cache_dir, chunk_size=64,
+            **kwargs,
+        )
+
+    def checks(self, report) -> set:
+        return {issue["check"] for issue in report.issues}
+
+    def test_clean(self):
+        report = self.check()
+        self.assertTrue(report.ok, report)
+        self.assertEqual(report.summary["n_frames"], 20)
+        self.assertEqual(report.summary["frame_pulses"], 20)
+
+    def test_partial_frame(self):
+        with open(self.session.path / "Image_0001_0001.raw", "ab") as f:
+            f.write(b"\0" * 10)
+        report = self.check()
+        self.assertEqual(self.checks(report), {"partial_frame"})
+        with self.assertWarns(UserWarning):
+            ThorImageArraySource(self.session.path).get_schema()
+
+    def test_sync_problems(self):
+        with h5py.File(self.h5_path, "a") as f:
+            clock = f["Global/GCtr"][:]
+            clock[500:] += 2000  # three samples dropped
+            f["Global/GCtr"][:] = clock
+            frame_out = f["DI/FrameOut"][:]
+            frame_out[:100] = 0
+            f["DI/FrameOut"][:] = frame_out
+            del f["DI/Strobe"]
+            f["DI/Strobe"] = np.ones((999, 1), dtype=np.uint32)
+        report = self.check()
+        self.assertEqual(
+            self.checks(report), {"gctr_gap", "length_mismatch", "frame_count"},
+        )
+        gap = [i for i in report.issues if i["check"] == "gctr_gap"][0]
+        self.assertEqual((gap["count"], gap["first"]), (1, 499))
+        self.assertIn(report.summary["gctr_step"], (666, 667))
+
+    def test_cache(self):
+        stats = instrument.enable_stats()
+        self.check()
+        reports = check_sessions(
+            [self.session.path], cache_dir=self.cache_dir,
+        )
+        self.assertTrue(reports[0].ok)
+        cache = stats.get("integrity", "cache")
+        self.assertEqual((cache.cache_hits, cache.cache_misses), (1, 1))
+
+        # A new file version is checked again.
+        with open(self.session.path / "Image_0001_0001.raw", "ab") as f:
+            f.write(b"\0" * 10)
+        self.assertFalse(self.check().ok)
+        self.assertEqual(stats.get("integrity", "cache").cache_misses, 2)
+
+
+class TestThorExperiment(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name))
+
+    def tearDown(self):
+        instrument.disable_stats()
+        instrument.reset_stats()
+        self._tmp.cleanup()
+
+    def test_members(self):
+        src = ThorExperimentSource(self.session.path, binary=["FrameOut"])
+        md = ThorImageMetadataSource(self.session.path).to_dict()
+        self.assertEqual(src.to_dict(), md)
+        self.assertTrue(np.array_equal(src.image.read(), self.session.frames))
+        df = ThorSyncSource(self.session.path, binary=["FrameOut"]).read()
+        self.assertTrue(src.sync.read().equals(df))
+
+        data = src.read()
+        self.assertEqual(set(data), {"metadata", "image", "sync"})
+        self.assertEqual(data["image"].shape, self.session.frames.shape)
+
+    def test_single_scan_and_parse(self):
+        stats = instrument.enable_stats()
+        src = ThorExperimentSource(self.session.path)
+        src.image.read()
+        src.sync.read()
+        src.to_dict()
+        by_phase = stats.by_phase()
+        self.assertEqual(by_phase["find_file"].calls, 1)
+        self.assertEqual(by_phase["parse_xml"].cache_misses, 1)
+
+    def test_member_schemas(self):
+        stats = instrument.enable_stats()
+        src = ThorExperimentSource(self.session.path, binary=["FrameOut"])
+        schema = src.get_schema()
+        frames = self.session.frames
+        self.assertEqual(tuple(schema["image"]["shape"]), frames.shape)
+        self.assertEqual(schema["image"]["dtype"], frames.dtype)
+        self.assertEqual(schema["image"]["chunks"], src.image.to_dask().chunks)
+        sync = ThorSyncSource(self.session.path, binary=["FrameOut"])
+        expected = sync.get_schema()
+        self.assertEqual(schema["sync"]["columns"], expected["columns"])
+        self.assertEqual(schema["sync"]["dtypes"], expected["dtypes"])
+        self.assertNotIn("extra_metadata", schema["image"])
+        by_phase = stats.by_phase()
+        self.assertEqual(by_phase["find_file"].calls, 2)  # src, then sync
+        self.assertEqual(by_phase["parse_xml"].cache_misses, 1)
+
+    def test_missing_member(self):
+        os.remove(self.session.path / "Episode001.h5")
+        src = ThorExperimentSource(self.session.path)
+        self.assertIsNone(src.files["sync"])
+        self.assertIsNone(src.get_schema()["sync"])
+        self.assertIsNone(src.read()["sync"])
+        with self.assertRaises(FileNotFoundError):
+            src.sync
+
+
+class TestAsync(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = Path(self._tmp.name)
+        self.paths = [make_session(root / f"s{i}").path for i in range(4)]
+
+    def tearDown(self):
+        get_pool().clear()
+        self._tmp.cleanup()
+
+    def test_sources(self):
+        import asyncio
+
+        path = self.paths[0]
+
+        async def main():
+            md = ThorImageMetadataSource(path)
+            sync = ThorSyncSource(path / "Episode001.h5")
+            return await asyncio.gather(md.to_dict_async(),
+                                        sync.get_schema_async())
+
+        md, schema = asyncio.run(main())
+        self.assertEqual(md, ThorImageMetadataSource(path).to_dict())
+        expected = ThorSyncSource(path / "Episode001.h5").get_schema()
+        self.assertEqual(schema["columns"], expected["columns"])
+
+    def test_gather_sessions(self):
+        import asyncio
+
+        from intake_thorlabs.aio import gather_sessions
+
+        missing = Path(self._tmp.name) / "missing"
+        sessions = asyncio.run(gather_sessions(
+            self.paths + [missing], binary=["FrameOut"],
+            return_exceptions=True,
+        ))
+        self.assertEqual(len(sessions), 5)
+        self.assertIsInstance(sessions[-1], NotADirectoryError)
+        for path, session in zip(self.paths, sessions):
+            self.assertEqual(session["path"], str(path))
+            self.assertEqual(session["metadata"]["modality"], "multiphoton")
+            self.assertEqual(session["sync"]["dtypes"]["FrameOut"], np.int8)
+            raw = session["files"]["image"]
+            self.assertEqual(session["stats"][raw]["size"], 20 * 8 * 8 * 2)
+
+    def test_backpressure(self):
+        import asyncio
+        import threading
+        import time
+
+        from intake_thorlabs.aio import BoundedExecutor
+
+        executor = BoundedExecutor(2, max_pending=3)
+        lock = threading.Lock()
+        state = dict(running=0, peak=0)
+
+        def job():
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            time.sleep(0.01)
+            with lock:
+                state["running"] -= 1
+
+        async def main():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.001)
+
+            task = asyncio.ensure_future(ticker())
+            sem = executor._semaphore(asyncio.get_running_loop())
+            jobs = [executor.run(job) for _ in range(12)]
+            waiting = asyncio.gather(*jobs)
+            await asyncio.sleep(0.005)
+            self.assertEqual(sem._value, 0)  # at most 3 submitted
+            await waiting
+            task.cancel()
+            return ticks
+
+        ticks = asyncio.run(main())
+        executor.shutdown()
+        self.assertLessEqual(state["peak"], 2)
+        self.assertGreater(ticks, 5)  # the loop kept running
+
+
+class TestH5Pool(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name))
+        self.path = self.session.path / "Episode001.h5"
+
+    def tearDown(self):
+        instrument.disable_stats()
+        instrument.reset_stats()
+        get_pool().clear()
+        self._tmp.cleanup()
+
+    def test_reuse(self):
+        stats = instrument.enable_stats()
+        src = ThorSyncSource(self.session.path)
+        src.get_schema()
+        src.read()
+        ThorSyncSource(self.session.path).get_schema()
+        open_h5 = stats.get("thorsync", "open_h5")
+        self.assertEqual(open_h5.opens, 1)
+        self.assertEqual((open_h5.cache_hits, open_h5.cache_misses), (1, 1))
+        memmap = stats.get("thorsync", "memmap")
+        self.assertEqual((memmap.cache_hits, memmap.cache_misses), (1, 0))
+
+    def test_lru_eviction(self):
+        pool = H5HandlePool(max_handles=1)
+        other = Path(self._tmp.name) / "other.h5"
+        with h5py.File(other, "w") as f:
+            f["x"] = np.arange(3)
+        with pool.acquire(self.path) as f1:
+            with pool.acquire(other) as f2:
+                # both in use; nothing can be evicted.
+                self.assertEqual(len(pool), 2)
+            self.assertEqual(len(pool), 1)
+            self.assertTrue(f1.id.valid)
+            self.assertFalse(f2.id.valid)
+        pool.configure(max_handles=0)
+        self.assertEqual(len(pool), 0)
+
+    def test_modified_file(self):
+        pool = H5HandlePool(rdcc_nbytes=2 ** 20)
+        with pool.acquire(self.path) as f:
+            first = f
+            self.assertEqual(f.id.get_access_plist().get_cache()[2], 2 ** 20)
+        # rewrite the file in place of the original.
+        tmp_path = self.path.with_suffix(".tmp")
+        with h5py.File(tmp_path, "w") as f:
+            f["extra"] = np.arange(10)
+        os.replace(tmp_path, self.path)
+        with pool.acquire(self.path) as f:
+            self.assertIn("extra", f)
+        self.assertFalse(first.id.valid)
+        self.assertEqual(len(pool), 1)
+        pool.clear()
+
+
+class TestThorSyncMemmap(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name))
+        self.path = self.session.path / "Episode001.h5"
+
+    def tearDown(self):
+        get_pool().clear()
+        self._tmp.cleanup()
+
+    def test_contiguous(self):
+        src = ThorSyncSource(self.path)
+        views = src.to_memmap()
+        self.assertEqual(set(views), {"GCtr", "Piezo", "FrameOut", "Strobe"})
+        for name, arr in views.items():
+            self.assertIsInstance(arr, np.memmap)
+            self.assertEqual(arr.ndim, 1)
+            self.assertFalse(arr.flags.writeable)
+        with h5py.File(self.path, "r") as f:
+            expected = f["AI/Piezo"][:].reshape(-1)
+        self.assertTrue(np.array_equal(views["Piezo"], expected))
+
+    def test_chunked_fallback(self):
+        with h5py.File(self.path, "a") as f:
+            data = f["AI/Piezo"][:]
+            del f["AI/Piezo"]
+            f.create_dataset("AI/Piezo", data=data, chunks=(100, 1),
+                             compression="gzip")
+        views = ThorSyncSource(self.path).to_memmap()
+        self.assertNotIsInstance(views["Piezo"], np.memmap)
+        self.assertIsInstance(views["Strobe"], np.memmap)
+        self.assertTrue(np.array_equal(views["Piezo"], data.reshape(-1)))
+
+    def test_dataframe_matches(self):
+        kw = dict(binary=["FrameOut"])
+        df1 = ThorSyncSource(self.path, memmap=True, **kw).read()
+        df2 = ThorSyncSource(self.path, memmap=False, **kw).read()
+        self.assertTrue(df1.equals(df2))
+        schema = ThorSyncSource(self.path, **kw).get_schema()
+        self.assertEqual(tuple(df1.columns), schema["columns"])
+        self.assertEqual(df1["FrameOut"].dtype, np.int8)
+        self.assertEqual(df1["Strobe"].dtype, np.int32)
+
+
+class TestRunLength(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name))
+        self.path = self.session.path / "Episode001.h5"
+        self.source = ThorSyncSource(self.path, binary=["FrameOut"])
+
+    def tearDown(self):
+        get_pool().clear()
+        self._tmp.cleanup()
+
+    def test_decode(self):
+        df = self.source.read()
+        # small chunks put run boundaries on chunk edges
+        runs = self.source.to_runs(chunk_size=25)
+        self.assertEqual(set(runs), {"FrameOut", "Strobe"})
+        for name, line in runs.items():
+            dense = line.decode()
+            self.assertEqual(dense.dtype, df[name].dtype)
+            self.assertTrue(np.array_equal(dense, df[name]))
+        self.assertEqual(runs["FrameOut"].n_runs, 40)
+        self.assertEqual(runs["Strobe"].n_runs, 1)
+        self.assertIs(self.source.to_runs(["Strobe"])["Strobe"], runs["Strobe"])
+        with self.assertRaises(KeyError):
+            self.source.to_runs(["Piezo"])
+
+    def test_queries(self):
+        df = self.source.read()
+        line = self.source.to_runs()["FrameOut"]
+        times = df["time"].to_numpy()
+        values = df["FrameOut"].to_numpy()
+
+        idx = [0, 24, 25, 26, 999]
+        self.assertTrue(np.array_equal(line.value_at(times[idx]), values[idx]))
+        self.assertTrue(np.array_equal(line.value_at(times[idx] + 1e-9),
+                                       values[idx]))
+        with self.assertRaises(ValueError):
+            line.value_at(times[-1] + 1)
+
+        rising = np.flatnonzero(np.diff(values) > 0) + 1
+        self.assertTrue(np.allclose(line.edges("rising"), times[rising]))
+        self.assertEqual(len(line.edges("falling")), 20)
+        # time-weighted: samples last 666 or 667 ticks
+        durations = np.diff(np.append(times, line.end_tick / line.clock_rate))
+        self.assertAlmostEqual(line.duty_cycle(),
+                               np.sum(durations * values) / np.sum(durations))
+        self.assertAlmostEqual(
+            line.duty_cycle(times[10], times[60]),
+            np.sum(durations[10:60] * values[10:60]) / np.sum(durations[10:60]),
+        )
+
+        high = line.intervals()
+        self.assertEqual(high.shape, (20, 2))
+        strobe = self.source.to_runs()["Strobe"]
+        self.assertTrue(np.array_equal(line.overlap(strobe), high))
+        window = [[times[10], times[60]]]
+        both = line.overlap(window)
+        self.assertAlmostEqual(
+            np.sum(both[:, 1] - both[:, 0]),
+            np.sum(np.diff(times[10:61]) * values[10:60]),
+        )
+
+
+    def test_clock_step(self):
+        from intake_thorlabs.runs import clock_step, encode_line
+
+        # GCtr runs at 20 MHz while lines are sampled at ~30 kHz
+        step, rate = 667, 20_000_000
+        clock = np.arange(100, dtype=np.uint64) * step
+        values = (np.arange(100) >= 70).astype(np.int8)
+        self.assertEqual(clock_step(clock), step)
+        line = encode_line(values, clock, rate, chunk_size=32)
+        self.assertEqual(line.end_tick, 100 * step)
+        self.assertAlmostEqual(line.stop_times[-1], 100 * step / rate)
+        self.assertAlmostEqual(line.duty_cycle(), 0.3)
+        self.assertAlmostEqual(np.sum(np.diff(line.intervals())),
+                               30 * step / rate)
+        # inside the last sample
+        self.assertEqual(line.value_at((99 * step + step // 2) / rate), 1)
+        with self.assertRaises(ValueError):
+            line.value_at(100 * step / rate)
+
+
+class TestColumnar(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name), n_samples=5000)
+        self.path = self.session.path / "Episode001.h5"
+        self.source = ThorSyncSource(self.path, binary=["FrameOut"])
+
+    def tearDown(self):
+        get_pool().clear()
+        self._tmp.cleanup()
+
+    def test_round_trip(self):
+        expected = self.source.read()
+        for suffix in (".parquet", ".arrow"):
+            dest = export_sync(self.source, Path(self._tmp.name) / f"sync{suffix}")
+            src = ThorSyncSource(dest)
+            df = src.read()
+            self.assertEqual(src.get_schema()["shape"], expected.shape)
+            self.assertEqual(list(df.columns), list(expected.columns))
+            for name in expected.columns:
+                self.assertTrue(np.array_equal(df[name], expected[name]))
+            self.assertTrue(df.dtypes.equals(expected.dtypes))
+            self.assertEqual(src.get_schema()["dtypes"],
+                             self.source.get_schema()["dtypes"])
+        # stored compactly
+        import pyarrow.parquet as pq
+
+        stored = pq.read_schema(Path(self._tmp.name) / "sync.parquet")
+        self.assertEqual(str(stored.field("Strobe").type), "int8")
+
+    def test_row_groups(self):
+        import pyarrow.parquet as pq
+
+        dest = Path(self._tmp.name) / "sync.parquet"
+        export_sync(self.source, dest, row_group_size=1000)
+        meta = pq.ParquetFile(dest).metadata
+        self.assertEqual(meta.num_row_groups, 5)
+        stats = meta.row_group(1).column(0).statistics
+        self.assertTrue(stats.has_min_max)
+        self.assertEqual(stats.min, gctr(1001)[-1] / self.source.clock_rate)
+
+    def test_pushdown(self):
+        dest = Path(self._tmp.name) / "sync.parquet"
+        export_sync(self.source, dest, row_group_size=1000)
+        clock_rate = self.source.clock_rate
+        kw = dict(
+            binary=["FrameOut"],
+            columns=["time", "Piezo", "Strobe", "FrameOut"],
+            time_range=(gctr(1501)[-1] / clock_rate,
+                        gctr(3201)[-1] / clock_rate),
+        )
+        from_h5 = ThorSyncSource(self.path, **kw)
+        from_pq = ThorSyncSource(dest, **kw)
+        self.assertEqual(from_pq.get_schema()["columns"],
+                         ("time", "Piezo", "Strobe", "FrameOut"))
+        self.assertEqual(from_pq.get_schema()["dtypes"],
+                         from_h5.get_schema()["dtypes"])
+        self.assertIsNone(from_h5.get_schema()["shape"][0])
+        df1, df2 = from_h5.read(), from_pq.read()
+        self.assertEqual(len(df1), 1700)
+        self.assertEqual(list(df1.columns),
+                         ["time", "Piezo", "Strobe", "FrameOut"])
+        self.assertEqual(df1["Strobe"].dtype, np.int32)
+        self.assertTrue(df1.reset_index(drop=True).equals(df2))
+
+    def test_unknown_column(self):
+        with self.assertRaises(KeyError):
+            ThorSyncSource(self.path, columns=["nope"]).discover()
+
+
+class TestInstrument(TestCase):
+
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = make_session(Path(self._tmp.name))
+        instrument.reset_stats()
+
+    def tearDown(self):
+        instrument.disable_stats()
+        instrument.reset_stats()
+        self._tmp.cleanup()
+
+    def test_disabled(self):
+        src = ThorSyncSource(self.session.path)
+        src.read()
+        self.assertEqual(instrument.get_stats().to_dict(), {})
+
+    def test_disabled_no_stat(self):
+        from unittest import mock
+
+        src = ThorImageMetadataSource(self.session.path)
+        src.discover()
+        with mock.patch("os.stat", wraps=os.stat) as stat:
+            src.read()
+        self.assertEqual(stat.call_count, 0)
+
+    def test_enabled(self):
+        stats = instrument.enable_stats()
+        ThorImageMetadataSource(self.session.path).to_dict()
+        src = ThorSyncSource(self.session.path)
+        src.read()
+        src.read()
+
+        md = stats.get("thorimagemetadata", "parse_xml")
+        self.assertEqual(md.calls, 1)
+        self.assertEqual(md.opens, 1)
+        self.assertGreater(md.bytes_read, 0)
+        self.assertEqual(stats.get("thorsync", "find_file").calls, 1)
+        self.assertEqual(stats.get("thorsync", "open_h5").opens, 1)
+        self.assertGreater(stats.get("thorsync", "read").bytes_read, 0)
+        cache = stats.get("thorsync", "cache")
+        self.assertEqual((cache.cache_hits, cache.cache_misses), (1, 1))
+
+    def test_log_events(self):
+        instrument.enable_stats(log=True)
+        with self.assertLogs("intake_thorlabs.io", level="DEBUG") as cm:
+            ThorImageMetadataSource(self.session.path).to_dict()
+        events = [rec.intake_thorlabs for rec in cm.records]
+        phases = [ev["phase"] for ev in events]
+        self.assertEqual(phases, ["find_file", "parse_xml"])
+        self.assertTrue(events[1]["path"].endswith("Experiment.xml"))
+
+
+class TestImport(TestCase):
+
+
+    def loaded_modules(self, stmt: str) -> set:
+        heavy = ("intake", "numpy", "pandas", "h5py", "dask")
+        code = f"import sys; {stmt}; " \
+               f"print(' '.join(m for m in {heavy!r} if m in sys.modules))"
+        root = str(Path(__file__).resolve().parents[1])
+        env = dict(os.environ, PYTHONPATH=root)
+        proc = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True, text=True, env=env, check=True,
+        )
+        return set(proc.stdout.split())
+
+    def test_package_import_is_light(self):
+        self.assertEqual(self.loaded_modules("import intake_thorlabs"), set())
+
+    def test_driver_import_is_light(self):
+        stmt = "import intake_thorlabs.thorimage, intake_thorlabs.thorsync"
+        loaded = self.loaded_modules(stmt)
+        self.assertFalse(loaded & {"pandas", "h5py", "dask"})
+
+    def test_lazy_exports(self):
+        stmt = "from intake_thorlabs import *; ThorSyncSource"
+        self.assertIn("intake", self.loaded_modules(stmt))
+
+
 if __name__ == "__main__":
     unittest.main()